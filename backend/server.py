@@ -1,37 +1,439 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.routing import APIRoute
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo import monitoring
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 import os
+import re
+import io
+import csv
+import codecs
+import json
+import base64
+import zlib
 import logging
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
+from typing import AsyncIterator, Dict, List, Optional
 import uuid
+import random
+import hashlib
+import hmac
+import math
+import time
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
+import orjson
+import brotli
+from cachetools import TTLCache
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ==================== METRICS ====================
+
+# Prometheus metrics, served at /metrics to holders of METRICS_TOKEN. Route
+# labels use the matched path template (e.g. /api/patients/{patient_id}) to
+# keep label cardinality bounded.
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", ["method"])
+MONGO_LATENCY = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ["collection", "command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+MONGO_FAILURES = Counter("mongo_command_failures_total", "Failed MongoDB commands", ["collection", "command"])
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "LLM call latency", ["model", "mode"],
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+)
+LLM_REQUESTS = Counter("llm_requests_total", "LLM calls by outcome", ["model", "mode", "outcome"])
+LLM_TOKENS = Counter("llm_tokens_estimated_total", "Estimated LLM tokens (chars/4)", ["model", "direction"])
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command per collection via pymongo command monitoring."""
+    
+    def __init__(self):
+        self.pending = {}
+    
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = "-"
+        self.pending[(event.connection_id, event.request_id)] = collection
+    
+    def succeeded(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "-")
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        self.profile(event, collection)
+    
+    def failed(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "-")
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(collection, event.command_name).inc()
+        self.profile(event, collection)
+    
+    def profile(self, event, collection: str):
+        # Motor runs commands with a copy of the caller's context, so this sees the request's profile
+        profile = current_profile.get()
+        if profile is not None:
+            end = time.perf_counter()
+            profile.add(f"db.{collection}.{event.command_name}", end - event.duration_micros / 1e6, end)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streaming responses are timed to completion."""
+    
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None
+    
+    def route_label(self, scope) -> str:
+        # Routing stores the matched endpoint in the scope; map it back to its path template
+        if self.route_paths is None:
+            self.route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        HTTP_IN_FLIGHT.labels(method).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = self.route_label(scope)
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            HTTP_IN_FLIGHT.labels(method).dec()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min/max rounds pin the cost so hashes made with any other cost are
+# flagged for rehashing on the next successful login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 security = HTTPBearer()
 JWT_SECRET = os.environ['JWT_SECRET']
 JWT_ALGORITHM = os.environ['JWT_ALGORITHM']
 JWT_EXPIRATION = int(os.environ['JWT_EXPIRATION_HOURS'])
+# Only these addresses may register with the admin role; admins control
+# profiling, counter rebuilds, background jobs and larger rate limits
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+# Password hashing pool
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', '32'))
+
+# LLM clients
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'emergent')  # emergent, stub
+LLM_MODEL = os.environ.get('LLM_MODEL', 'openai/gpt-4o')
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT_SECONDS', '60'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF_SECONDS', '0.5'))
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE_SECONDS', '90'))  # whole call, retries included
+
+# Chat response cache (opt-in)
+CHAT_CACHE_ENABLED = os.environ.get('CHAT_CACHE_ENABLED', 'false').lower() == 'true'
+CHAT_CACHE_TTL = int(os.environ.get('CHAT_CACHE_TTL_SECONDS', '86400'))
+CHAT_CACHE_SIMILARITY = float(os.environ.get('CHAT_CACHE_SIMILARITY', '0.85'))
+CHAT_CACHE_CANDIDATES = int(os.environ.get('CHAT_CACHE_CANDIDATES', '50'))
+
+# Chat context
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', '600'))
+CHAT_SUMMARY_EXCERPT_CHARS = int(os.environ.get('CHAT_SUMMARY_EXCERPT_CHARS', '280'))
+CHAT_SUMMARY_CONDENSE = os.environ.get('CHAT_SUMMARY_CONDENSE', 'true').lower() == 'true'
+
+# Chat history write-behind
+CHAT_HISTORY_BATCH_SIZE = int(os.environ.get('CHAT_HISTORY_BATCH_SIZE', '100'))
+CHAT_HISTORY_FLUSH_SECONDS = float(os.environ.get('CHAT_HISTORY_FLUSH_SECONDS', '1'))
+CHAT_HISTORY_MAX_PENDING = int(os.environ.get('CHAT_HISTORY_MAX_PENDING', '10000'))
+
+# Bulk patient import
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', '1000'))
+BULK_IMPORT_MAX_ERRORS = int(os.environ.get('BULK_IMPORT_MAX_ERRORS', '1000'))
+
+# Patient search
+PATIENT_SEARCH_MIN_SIMILARITY = float(os.environ.get('PATIENT_SEARCH_MIN_SIMILARITY', '0.4'))
+PATIENT_SEARCH_MAX_CANDIDATES = int(os.environ.get('PATIENT_SEARCH_MAX_CANDIDATES', '5000'))
+PATIENT_SEARCH_STATS_TTL = int(os.environ.get('PATIENT_SEARCH_STATS_TTL', '300'))
+
+# Scheduling
+DEFAULT_APPOINTMENT_MINUTES = int(os.environ.get('DEFAULT_APPOINTMENT_MINUTES', '30'))
+CLINIC_DAY_START = os.environ.get('CLINIC_DAY_START', '09:00')
+CLINIC_DAY_END = os.environ.get('CLINIC_DAY_END', '17:00')
+SCHEDULE_MAX_RETRIES = int(os.environ.get('SCHEDULE_MAX_RETRIES', '10'))
+# Intervals younger than this may belong to a booking still being saved, so
+# the orphan sweep leaves them alone even if no appointment holds them yet
+SCHEDULE_INTERVAL_GRACE = int(os.environ.get('SCHEDULE_INTERVAL_GRACE_SECONDS', '300'))
+
+# Optimistic concurrency
+UPDATE_MAX_RETRIES = int(os.environ.get('UPDATE_MAX_RETRIES', '5'))
+
+# Fast list responses (opt-in)
+FAST_LIST_RESPONSES = os.environ.get('FAST_LIST_RESPONSES', 'false').lower() == 'true'
+
+# HTTP caching. Cache-Control per cacheable read route; "no-cache" lets the
+# browser keep the body but revalidate it with If-None-Match every time. The
+# CACHE_CONTROL setting overrides individual routes and keeps the rest.
+CACHE_CONTROL = {
+    "patient": "private, no-cache",
+    "patients": "private, no-cache",
+    "patient_search": "private, no-cache",
+    "appointment": "private, no-cache",
+    "appointments": "private, no-cache",
+    **json.loads(os.environ.get('CACHE_CONTROL', '{}')),
+}
+
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+
+# Change feed
+CHANGE_FEED_SOURCE = os.environ.get('CHANGE_FEED_SOURCE', 'change_stream')  # change_stream, local
+CHANGE_FEED_HISTORY = int(os.environ.get('CHANGE_FEED_HISTORY', '1000'))
+CHANGE_FEED_QUEUE_SIZE = int(os.environ.get('CHANGE_FEED_QUEUE_SIZE', '256'))
+CHANGE_FEED_AUTH_TIMEOUT = float(os.environ.get('CHANGE_FEED_AUTH_TIMEOUT', '10'))
+
+# Background jobs
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', '500'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+ORPHAN_SWEEP_INTERVAL = int(os.environ.get('ORPHAN_SWEEP_INTERVAL_SECONDS', '3600'))  # 0 disables
+ARCHIVE_DELETED_APPOINTMENTS = os.environ.get('ARCHIVE_DELETED_APPOINTMENTS', 'true').lower() == 'true'
+
+# Authenticated-user cache
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+
+# Metrics. /metrics is only served when METRICS_TOKEN is set, and then only to
+# scrapers sending it as a bearer token (Prometheus `authorization` config).
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Rate limiting. RATE_LIMITS maps a rule to "capacity/seconds" per role, with
+# "default" used for roles (and anonymous callers) without their own entry.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory, mongo
+RATE_LIMITS = json.loads(os.environ.get('RATE_LIMITS', json.dumps({
+    "auth": {"default": "10/60"},
+    "auth_ip": {"default": "30/60"},
+    "chat": {"default": "20/60", "admin": "60/60"},
+})))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+# Behind a reverse proxy or ingress every request arrives from the proxy's
+# address. Set RATE_LIMIT_TRUST_PROXY to take the client address from
+# X-Forwarded-For instead, counting RATE_LIMIT_PROXY_HOPS entries from the
+# right (one per proxy that appends to the header); entries further left are
+# client-supplied and can be forged. Only enable it when the backend is not
+# reachable except through those proxies.
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '1'))
+
+# Request profiling (opt-in). When enabled, requests are sampled at
+# PROFILE_SAMPLE_RATE, which admins can change at runtime. PROFILE_HEADER
+# forces profiling only on an admin's request, or when its value is
+# PROFILE_SECRET. PROFILE_DIR keeps at most PROFILE_MAX_FILES profiles.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Profile')
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '1000'))
+
+# ==================== PROFILING ====================
+
+# Profiled requests get a RequestProfile in a context variable; instrumented
+# code adds timed spans to it. Spans are summed by category ("auth", "db",
+# "bcrypt", "llm", "endpoint", "serialize") into a Server-Timing header and,
+# if PROFILE_DIR is set, written in full as one JSON file per request. With
+# no profile active each instrumentation point costs one ContextVar lookup.
+current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+profiling_state = {"sample_rate": PROFILE_SAMPLE_RATE}
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = str(uuid.uuid4())
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.endpoint_end = None
+        self.spans = []
+    
+    def add(self, name: str, start: float, end: float):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3)
+        })
+    
+    def totals(self) -> dict:
+        totals = {}
+        for span in self.spans:
+            category = span['name'].split(".", 1)[0]
+            totals[category] = totals.get(category, 0) + span['duration_ms']
+        return totals
+    
+    def server_timing(self) -> str:
+        metrics = [f"{category};dur={duration:.3f}" for category, duration in self.totals().items()]
+        metrics.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.3f}")
+        return ", ".join(metrics)
+    
+    def to_dict(self, status_code: int) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "started_at": self.started_at.isoformat(),
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "totals_ms": {category: round(duration, 3) for category, duration in self.totals().items()},
+            "spans": self.spans
+        }
+
+@contextmanager
+def profile_span(name: str):
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, start, time.perf_counter())
+
+def profiled_endpoint(endpoint):
+    """Time the route function itself; what follows until the response starts is serialization."""
+    # include_router rebuilds each route with the same route class, so guard against double wrapping
+    if getattr(endpoint, "profiled", False):
+        return endpoint
+    
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return await endpoint(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            profile.endpoint_end = time.perf_counter()
+            profile.add("endpoint", start, profile.endpoint_end)
+    wrapper.profiled = True
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, profiled_endpoint(endpoint), **kwargs)
+
+def write_profile(data: dict):
+    path = Path(PROFILE_DIR) / f"{data['started_at'][:19].replace(':', '')}-{data['id']}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2))
+    # Names start with the timestamp, so the oldest sort first
+    profiles = sorted(path.parent.glob("*.json"))
+    for old in profiles[:max(0, len(profiles) - PROFILE_MAX_FILES)]:
+        old.unlink(missing_ok=True)
+
+class ProfilingMiddleware:
+    """Starts a RequestProfile for selected requests and reports it when the response starts."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def may_force(self, headers: dict, value: bytes) -> bool:
+        """Whether the caller may force profiling: the shared secret, or an admin's token."""
+        if PROFILE_SECRET and hmac.compare_digest(value, PROFILE_SECRET.encode()):
+            return True
+        scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+        try:
+            return (await resolve_user(token)).role == "admin"
+        except HTTPException:
+            return False
+    
+    async def should_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        value = headers.get(PROFILE_HEADER.lower().encode(), b"")
+        if value not in (b"", b"0") and await self.may_force(headers, value):
+            return True
+        return random.random() < profiling_state["sample_rate"]
+    
+    async def __call__(self, scope, receive, send):
+        if not PROFILING_ENABLED or scope["type"] != "http" or not await self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = current_profile.set(profile)
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profile.endpoint_end is not None:
+                    profile.add("serialize", profile.endpoint_end, time.perf_counter())
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode()))
+                headers.append((b"x-profile-id", profile.id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(token)
+            if PROFILE_DIR:
+                try:
+                    await asyncio.to_thread(write_profile, profile.to_dict(status_code))
+                except OSError as e:
+                    logger.warning(f"Could not write profile {profile.id}: {str(e)}")
 
 # Create the main app
 app = FastAPI(title="SmartClinic AI")
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=ProfiledRoute)
 
 # ==================== MODELS ====================
 
@@ -69,6 +471,7 @@ class Patient(BaseModel):
     gender: str
     address: str
     medical_history: Optional[str] = ""
+    version: int = 1
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -92,6 +495,16 @@ class PatientUpdate(BaseModel):
     address: Optional[str] = None
     medical_history: Optional[str] = None
 
+class BulkImportError(BaseModel):
+    row: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkImportError]
+    errors_truncated: bool = False
+
 class Appointment(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -100,9 +513,11 @@ class Appointment(BaseModel):
     doctor_name: str
     appointment_date: str
     appointment_time: str
+    duration_minutes: int = DEFAULT_APPOINTMENT_MINUTES
     reason: str
     status: str = "scheduled"  # scheduled, completed, cancelled
     notes: Optional[str] = ""
+    version: int = 1
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class AppointmentCreate(BaseModel):
@@ -111,16 +526,59 @@ class AppointmentCreate(BaseModel):
     doctor_name: str
     appointment_date: str
     appointment_time: str
+    duration_minutes: int = Field(DEFAULT_APPOINTMENT_MINUTES, gt=0, le=24 * 60)
     reason: str
     notes: Optional[str] = ""
 
 class AppointmentUpdate(BaseModel):
     appointment_date: Optional[str] = None
     appointment_time: Optional[str] = None
+    duration_minutes: Optional[int] = Field(None, gt=0, le=24 * 60)
     reason: Optional[str] = None
     status: Optional[str] = None
     notes: Optional[str] = None
 
+class DoctorAvailability(BaseModel):
+    doctor_name: str
+    date: str
+    slots: List[str]
+
+class AppointmentCounts(BaseModel):
+    total: int
+    upcoming: int
+    past: int
+    by_status: Dict[str, int]
+
+class PatientOverview(BaseModel):
+    patient: Patient
+    upcoming_appointments: List[Appointment]
+    past_appointments: List[Appointment]
+    appointment_counts: AppointmentCounts
+
+class Job(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    type: str
+    status: str  # queued, running, completed, failed
+    params: dict = {}
+    progress: Dict[str, int] = {}
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+class DashboardStats(BaseModel):
+    total_patients: int
+    total_appointments: int
+    today_appointments: int
+
+class ProfilingSettings(BaseModel):
+    enabled: bool
+    sample_rate: float
+
+class ProfilingSettingsUpdate(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)
+
 class ChatMessage(BaseModel):
     message: str
     session_id: Optional[str] = None
@@ -138,13 +596,138 @@ class ChatHistory(BaseModel):
     response: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# ==================== DATABASE INDEXES ====================
+
+# One entry per access pattern used by the routes below. Unique indexes back
+# the lookups by `id` and `email`; the compound chat_history index serves the
+# (session_id, user_id) filter together with the timestamp sort.
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True, name="users_id_unique"),
+        IndexModel([("email", ASCENDING)], unique=True, name="users_email_unique"),
+    ],
+    "patients": [
+        IndexModel([("id", ASCENDING)], unique=True, name="patients_id_unique"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="patients_page"),
+        IndexModel([("first_name_lower", ASCENDING)], name="patients_first_name_lower"),
+        IndexModel([("last_name_lower", ASCENDING)], name="patients_last_name_lower"),
+        IndexModel([("search_grams", ASCENDING)], name="patients_search_grams"),
+    ],
+    "appointments": [
+        IndexModel([("id", ASCENDING)], unique=True, name="appointments_id_unique"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="appointments_page"),
+        IndexModel([("starts_at", ASCENDING), ("status", ASCENDING)], name="appointments_starts_at_status"),
+        IndexModel([("doctor_name", ASCENDING), ("starts_at", ASCENDING)], name="appointments_doctor_starts_at"),
+        IndexModel([("patient_id", ASCENDING)], name="appointments_patient_id"),
+    ],
+    "archived_appointments": [
+        IndexModel([("id", ASCENDING)], unique=True, name="archived_appointments_id_unique"),
+        IndexModel([("patient_id", ASCENDING)], name="archived_appointments_patient_id"),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="jobs_id_unique"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="jobs_status_lease"),
+        IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=JOB_RETENTION_DAYS * 86400, name="jobs_ttl"),
+    ],
+    "chat_history": [
+        IndexModel([("id", ASCENDING)], unique=True, name="chat_history_id_unique"),
+        IndexModel(
+            [("session_id", ASCENDING), ("user_id", ASCENDING), ("timestamp", DESCENDING)],
+            name="chat_history_session_user_timestamp",
+        ),
+    ],
+    "doctor_schedules": [
+        IndexModel([("doctor_name", ASCENDING), ("date", ASCENDING)], name="doctor_schedules_doctor_date"),
+    ],
+    "chat_sessions": [
+        IndexModel([("session_id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="chat_sessions_session_user_unique"),
+    ],
+    "chat_cache": [
+        IndexModel([("key", ASCENDING)], unique=True, name="chat_cache_key_unique"),
+        IndexModel([("user_id", ASCENDING), ("terms", ASCENDING)], name="chat_cache_user_terms"),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=CHAT_CACHE_TTL, name="chat_cache_ttl"),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="rate_limits_ttl"),
+    ],
+}
+
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+def index_spec(info: dict) -> tuple:
+    """The keys and options that define an index, from index_information() or an IndexModel document."""
+    keys = info['key'].items() if hasattr(info['key'], "items") else info['key']
+    key = tuple((field, int(direction) if isinstance(direction, float) else direction) for field, direction in keys)
+    # Compare with False by identity: expireAfterSeconds may be 0, which == False
+    options = {option: info.get(option) for option in INDEX_OPTIONS}
+    return key, {option: value for option, value in options.items() if value is not None and value is not False}
+
+async def ensure_indexes():
+    """Create any missing indexes, failing startup if one cannot be built.
+    
+    An index counts as present when one with the same keys and options
+    exists under any name. One that shares a name or keys but differs in
+    options is dropped and rebuilt, since creating over it would fail.
+    """
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = {name: index_spec(info) for name, info in (await collection.index_information()).items()}
+        stale, missing = [], []
+        for index in indexes:
+            name, spec = index.document['name'], index_spec(index.document)
+            if spec in existing.values():
+                continue
+            stale += [other for other, other_spec in existing.items() if other == name or other_spec[0] == spec[0]]
+            missing.append(index)
+        if not stale and not missing:
+            continue
+        try:
+            for name in dict.fromkeys(stale):
+                await collection.drop_index(name)
+                logger.info(f"Dropped index {name} on {collection_name}")
+            if missing:
+                created = await collection.create_indexes(missing)
+                logger.info(f"Built indexes on {collection_name}: {', '.join(created)}")
+        except OperationFailure as e:
+            # Typically duplicate keys already present in the collection
+            logger.error(f"Index build failed on {collection_name}: {str(e)}")
+            raise RuntimeError(f"Could not build indexes on {collection_name}: {str(e)}") from e
+
 # ==================== HELPER FUNCTIONS ====================
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event
+# loop. Jobs beyond PASSWORD_HASH_QUEUE_LIMIT (running + waiting) are rejected
+# with 429 rather than queued indefinitely.
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_pool_state = {"pending": 0}
+Gauge("password_hash_jobs_pending", "Password hash jobs running or queued").set_function(
+    lambda: password_pool_state["pending"]
+)
+Gauge("password_hash_queue_limit", "Maximum pending password hash jobs").set(PASSWORD_HASH_QUEUE_LIMIT)
+
+async def run_password_job(func, *args):
+    if password_pool_state["pending"] >= PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=429,
+            detail="Authentication service is busy, please retry",
+            headers={"Retry-After": "1"}
+        )
+    password_pool_state["pending"] += 1
+    try:
+        with profile_span("bcrypt"):
+            return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_pool_state["pending"] -= 1
+
+async def hash_password(password: str) -> str:
+    return await run_password_job(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_job(pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple:
+    """Verify a password, returning (valid, new_hash) where new_hash is set if the cost changed."""
+    return await run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -153,8 +736,32 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+# ==================== USER CACHE ====================
+
+# Resolved users keyed by id, and decoded tokens keyed by their SHA-256 so a
+# repeated token skips JWT verification. Both are LRU-bounded with a TTL. No
+# route changes or deletes users; a change made directly in the database is
+# picked up within USER_CACHE_TTL seconds.
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+token_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+USER_CACHE_HITS = Counter("user_cache_hits", "Authenticated-user cache hits")
+USER_CACHE_MISSES = Counter("user_cache_misses", "Authenticated-user cache misses")
+
+def clear_user_cache():
+    user_cache.clear()
+    token_cache.clear()
+
+def decode_token(token: str) -> str:
+    """Return the user id for a valid token, using the token cache when possible."""
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    cached = token_cache.get(token_hash)
+    if cached is not None:
+        user_id, expires_at = cached
+        if expires_at > datetime.now(timezone.utc).timestamp():
+            return user_id
+        token_cache.pop(token_hash, None)
+        raise HTTPException(status_code=401, detail="Token has expired")
+    
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id: str = payload.get("sub")
@@ -162,22 +769,1365 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    token_cache[token_hash] = (user_id, payload["exp"])
+    return user_id
+
+async def resolve_user(token: str) -> User:
+    user_id = decode_token(token)
+    
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        USER_CACHE_HITS.inc()
+        return cached_user
+    USER_CACHE_MISSES.inc()
+    
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    current_user = User(**user)
+    user_cache[user_id] = current_user
+    return current_user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    with profile_span("auth.get_current_user"):
+        return await resolve_user(credentials.credentials)
+
+# ==================== RATE LIMITING ====================
+
+# Token buckets keyed by user id (chat) or client IP (auth). A bucket holds up
+# to `capacity` tokens and refills continuously at capacity/seconds; each
+# request takes one token. The memory store is per-process; the mongo store
+# shares buckets across workers at the cost of a round trip per request.
+RATE_LIMITED_REQUESTS = Counter("rate_limited_requests_total", "Requests rejected by the rate limiter", ["rule"])
+
+def parse_rate(value: str) -> tuple:
+    """Parse "capacity/seconds" into (capacity, tokens per second)."""
+    capacity, seconds = value.split("/", 1)
+    return int(capacity), int(capacity) / float(seconds)
+
+RATE_LIMIT_RULES = {
+    rule: {role: parse_rate(rate) for role, rate in roles.items()}
+    for rule, roles in RATE_LIMITS.items()
+}
+
+def refill_bucket(bucket: Optional[dict], now: float, capacity: int, rate: float) -> tuple:
+    """Return (tokens left after taking one, seconds to wait); wait is 0 when a token was taken."""
+    tokens = capacity
+    if bucket is not None:
+        tokens = min(capacity, bucket['tokens'] + (now - bucket['updated']) * rate)
+    if tokens < 1:
+        return tokens, (1 - tokens) / rate
+    return tokens - 1, 0.0
+
+class MemoryRateLimitStore:
+    def __init__(self):
+        # An evicted bucket has had time to refill completely, so expiring it is lossless
+        refill_seconds = max(
+            (capacity / rate for roles in RATE_LIMIT_RULES.values() for capacity, rate in roles.values()),
+            default=60
+        )
+        self.buckets = TTLCache(maxsize=RATE_LIMIT_MAX_KEYS, ttl=refill_seconds)
+    
+    async def take(self, key: str, capacity: int, rate: float) -> float:
+        now = time.monotonic()
+        tokens, wait = refill_bucket(self.buckets.get(key), now, capacity, rate)
+        if not wait:
+            self.buckets[key] = {"tokens": tokens, "updated": now}
+        return wait
+
+class MongoRateLimitStore:
+    async def take(self, key: str, capacity: int, rate: float) -> float:
+        for _ in range(UPDATE_MAX_RETRIES):
+            bucket = await db.rate_limits.find_one({"_id": key})
+            now = time.time()
+            tokens, wait = refill_bucket(bucket, now, capacity, rate)
+            if wait:
+                return wait
+            
+            fields = {
+                "tokens": tokens,
+                "updated": now,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=capacity / rate)
+            }
+            if bucket is None:
+                try:
+                    await db.rate_limits.insert_one({"_id": key, **fields})
+                    return 0.0
+                except DuplicateKeyError:
+                    continue
+            
+            # Compare-and-swap on the last update time
+            result = await db.rate_limits.update_one({"_id": key, "updated": bucket['updated']}, {"$set": fields})
+            if result.modified_count:
+                return 0.0
+        
+        # A bucket this contended is being hammered; treat it as empty
+        return 1.0
+
+RATE_LIMIT_STORES = {
+    "memory": MemoryRateLimitStore,
+    "mongo": MongoRateLimitStore,
+}
+
+if RATE_LIMIT_BACKEND not in RATE_LIMIT_STORES:
+    raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+rate_limit_store = RATE_LIMIT_STORES[RATE_LIMIT_BACKEND]()
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if forwarded:
+            return forwarded[-min(RATE_LIMIT_PROXY_HOPS, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(rule: str, key: str, role: Optional[str] = None):
+    roles = RATE_LIMIT_RULES.get(rule)
+    if not RATE_LIMIT_ENABLED or not roles:
+        return
+    limit = roles.get(role) or roles.get("default")
+    if limit is None:
+        return
+    
+    wait = await rate_limit_store.take(f"{rule}:{key}", *limit)
+    if wait:
+        RATE_LIMITED_REQUESTS.labels(rule).inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please retry later",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+def rate_limit_by_user(rule: str):
+    """Dependency that rate limits per authenticated user and returns the user."""
+    async def dependency(current_user: User = Depends(get_current_user)) -> User:
+        await enforce_rate_limit(rule, f"user:{current_user.id}", current_user.role)
+        return current_user
+    return dependency
+
+def rate_limit_by_account(rule: str, ip_rule: str):
+    """Dependency that rate limits per client IP and submitted email, for login and registration.
+    
+    Staff behind one proxy or office NAT share an address, so a tight per-IP
+    bucket alone would throttle the whole clinic at once. A roomier one under
+    `ip_rule` still stops a single address from cycling through emails to
+    fill the password hashing queue.
+    """
+    async def dependency(request: Request):
+        try:
+            body = await request.json()
+            email = str(body.get("email", "")).strip().lower() if isinstance(body, dict) else ""
+        except ValueError:
+            # Malformed bodies are rejected by validation after this
+            email = ""
+        ip = client_ip(request)
+        await enforce_rate_limit(rule, f"ip:{ip}:email:{email}")
+        await enforce_rate_limit(ip_rule, f"ip:{ip}")
+    return dependency
+
+# ==================== FAST RESPONSES ====================
+
+# Every stored patient and appointment is written through its Pydantic model,
+# so list routes can skip re-validating each row against response_model. With
+# FAST_LIST_RESPONSES on they fetch exactly the model's fields and hand the
+# documents straight to orjson, producing the same JSON as the validated path.
+PATIENT_FIELDS_PROJECTION = {"_id": 0, **{field: 1 for field in Patient.model_fields}}
+APPOINTMENT_FIELDS_PROJECTION = {"_id": 0, **{field: 1 for field in Appointment.model_fields}}
+
+# `fields=` narrows a list to some model fields in the Mongo projection. The
+# pagination cursor is built from created_at and id, so those are always kept.
+LIST_REQUIRED_FIELDS = ("id", "created_at")
+
+# Match Pydantic's datetime format ("Z" suffix for UTC)
+FAST_JSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC
+
+class FastJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=FAST_JSON_OPTIONS)
+
+def fields_projection(model, fields: Optional[str]) -> Optional[dict]:
+    """Projection for a comma-separated `fields` parameter, or None when not given."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - model.model_fields.keys()
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {"_id": 0, **{field: 1 for field in LIST_REQUIRED_FIELDS}, **{field: 1 for field in requested}}
+
+def new_compressor(encoding: str) -> tuple:
+    """Return (compress, finish) callables for a "br" or "gzip" stream."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+class CompressionMiddleware:
+    """Brotli or gzip, per Accept-Encoding, for bodies of at least COMPRESSION_MIN_SIZE.
+    
+    Streamed bodies are compressed as they go. Server-Sent Events are left
+    alone, since a compressor would hold chat tokens back until it fills a block.
+    """
+    
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    def choose_encoding(self, scope) -> Optional[str]:
+        accepted = set()
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                for part in value.decode("latin-1").lower().split(","):
+                    coding, _, params = part.partition(";")
+                    quality = params.strip().removeprefix("q=") or "1"
+                    try:
+                        if float(quality) > 0:
+                            accepted.add(coding.strip())
+                    except ValueError:
+                        continue
+        if "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+    
+    async def __call__(self, scope, receive, send):
+        encoding = self.choose_encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        
+        start_message = None
+        compressor = None
+        
+        async def send_wrapper(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk shows whether to compress
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(raw=list(start.get("headers", [])))
+                if (
+                    "content-encoding" in headers
+                    or headers.get("content-type", "").startswith("text/event-stream")
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    await send(start)
+                    await send(message)
+                    return
+                
+                compressor = new_compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    body = compressor[0](body) + compressor[1]()
+                    headers["Content-Length"] = str(len(body))
+                    await send({**start, "headers": headers.raw})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start, "headers": headers.raw})
+            
+            if compressor is None:
+                await send(message)
+                return
+            compress, finish = compressor
+            chunk = compress(body)
+            if not more_body:
+                chunk += finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        
+        await self.app(scope, receive, send_wrapper)
+
+def list_response(docs: List[dict], response: Response, partial: bool = False):
+    # Partial documents would fail response_model validation, so they always take the fast path
+    if not FAST_LIST_RESPONSES and not partial:
+        return docs
+    # Headers set on the injected response are not merged into returned responses
+    return FastJSONResponse(docs, headers=dict(response.headers))
+
+# ==================== MIGRATIONS ====================
+
+# One-shot data migrations, recorded in db.migrations so each runs once.
+# Timestamps used to be stored as ISO strings; they are now BSON datetimes.
+DATETIME_FIELDS = {
+    "users": ["created_at"],
+    "patients": ["created_at", "updated_at"],
+    "appointments": ["created_at"],
+    "chat_history": ["timestamp"],
+    "chat_sessions": ["updated_at"],
+}
+
+async def migrate_typed_datetimes():
+    for collection_name, fields in DATETIME_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            updates = []
+            async for doc in collection.find({field: {"$type": "string"}}, {"_id": 1, field: 1}):
+                try:
+                    value = datetime.fromisoformat(doc[field])
+                except (ValueError, TypeError):
+                    logger.warning(f"{collection_name} {doc['_id']} has an unparseable {field}; left as a string")
+                    continue
+                updates.append(UpdateOne({"_id": doc['_id']}, {"$set": {field: value}}))
+                if len(updates) >= 1000:
+                    await collection.bulk_write(updates, ordered=False)
+                    updates = []
+            if updates:
+                await collection.bulk_write(updates, ordered=False)
+    
+    updates = []
+    async for doc in db.appointments.find({"starts_at": {"$exists": False}}, {"_id": 1, "id": 1, "appointment_date": 1, "appointment_time": 1, "duration_minutes": 1}):
+        try:
+            bounds = appointment_bounds(doc)
+        except HTTPException:
+            logger.warning(f"Appointment {doc.get('id')} has an unparseable date or time; left without starts_at")
+            continue
+        updates.append(UpdateOne({"_id": doc['_id']}, {"$set": bounds}))
+        if len(updates) >= 1000:
+            await db.appointments.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db.appointments.bulk_write(updates, ordered=False)
+
+async def migrate_document_versions():
+    for collection in (db.patients, db.appointments):
+        await collection.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+
+async def migrate_appointment_durations():
+    # Fast list responses return stored fields as-is, so fill in the model default
+    await db.appointments.update_many(
+        {"duration_minutes": {"$exists": False}},
+        {"$set": {"duration_minutes": DEFAULT_APPOINTMENT_MINUTES}}
+    )
+
+async def migrate_appointment_statuses():
+    # Filters such as ?status=scheduled only see stored fields, so fill in the model default
+    await db.appointments.update_many({"status": {"$exists": False}}, {"$set": {"status": "scheduled"}})
+
+MIGRATIONS = [
+    ("typed_datetimes", migrate_typed_datetimes),
+    ("document_versions", migrate_document_versions),
+    ("appointment_durations", migrate_appointment_durations),
+    ("appointment_statuses", migrate_appointment_statuses),
+]
+
+async def run_migrations():
+    for name, migration in MIGRATIONS:
+        if await db.migrations.find_one({"_id": name}):
+            continue
+        logger.info(f"Running migration {name}")
+        await migration()
+        await db.migrations.insert_one({"_id": name, "completed_at": datetime.now(timezone.utc)})
+
+# ==================== PAGINATION ====================
+
+# List routes page through results ordered by (created_at, id). The cursor is
+# an opaque token encoding the sort key of the last item on the previous page;
+# the token for the following page is returned in the X-Next-Cursor header.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(doc: dict) -> str:
+    key = json.dumps([doc['created_at'].isoformat(), doc['id']])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, item_id
+
+def prefix_regex(value: str) -> dict:
+    # Anchored and case-sensitive, so Mongo can scan just the index range
+    # for the prefix; match against lower-cased copies of the field.
+    return {"$regex": f"^{re.escape(value)}"}
+
+async def fetch_page(collection, query: dict, cursor: Optional[str], limit: int, response: Response, projection: Optional[dict] = None) -> List[dict]:
+    """Run a keyset-paginated query and set the next-page cursor header."""
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": item_id}},
+        ]}]}
+    
+    # Fetch one extra document to learn whether another page exists
+    docs = await collection.find(query, projection or {"_id": 0}).sort(
+        [("created_at", ASCENDING), ("id", ASCENDING)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1])
+    return docs
+
+# ==================== OPTIMISTIC CONCURRENCY ====================
+
+# Patients and appointments carry a `version` that every write increments.
+# Reads return it as the ETag; a write sent with If-Match only applies if the
+# document is still at that version and otherwise fails with 412.
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Return the version an If-Match header requires, or None for no precondition.
+    
+    Deviates from RFC 9110, which gives If-Match strong comparison and so
+    never matches a weak tag: W/"3" and "3" are both accepted as version 3.
+    The ETag is weak only because compression varies the body bytes; the
+    version itself identifies exactly one stored state of the record, so a
+    weak tag from a read is as safe a precondition as a strong one.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+def versioned_filter(item_id: str, version: Optional[int]) -> dict:
+    query = {"id": item_id}
+    if version is not None:
+        query["version"] = version
+    return query
+
+def set_etag(response: Response, doc: dict):
+    response.headers["ETag"] = item_etag(doc)
+
+async def raise_write_failure(collection, item_id: str, expected_version: Optional[int], label: str):
+    """Explain why a versioned write matched nothing: stale version (412) or missing (404)."""
+    if expected_version is not None and await collection.find_one({"id": item_id}, {"_id": 1}):
+        raise HTTPException(status_code=412, detail=f"{label} was modified by another request")
+    raise HTTPException(status_code=404, detail=f"{label} not found")
+
+# ==================== HTTP CACHING ====================
+
+# Single-record reads use the record version as the ETag. List and search
+# reads use a per-collection version from the "versions" document in
+# db.counters, which write routes bump after every change; its random epoch
+# keeps tags from repeating if the document is ever recreated. The version is
+# read before the query, so a tag is never newer than the body it labels. A
+# matching If-None-Match gets a bodiless 304 before any serialization. Tags
+# are weak: the same version is served gzip, brotli or uncompressed, and a
+# strong tag would have to differ per content-coding.
+COLLECTION_VERSIONS_ID = "versions"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    opaque = etag.removeprefix("W/")
+    return opaque in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+def item_etag(doc: dict) -> str:
+    return f'W/"{doc["version"]}"'
+
+def not_modified(etag: str, route: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL[route]})
+
+def set_cache_headers(response: Response, etag: str, route: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL[route]
+
+async def bump_collection_version(collection_name: str):
+    await db.counters.update_one(
+        {"_id": COLLECTION_VERSIONS_ID},
+        {"$inc": {collection_name: 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+        upsert=True
+    )
+
+async def collection_etag(collection_name: str) -> str:
+    versions = await db.counters.find_one({"_id": COLLECTION_VERSIONS_ID})
+    if versions is None:
+        versions = await db.counters.find_one_and_update(
+            {"_id": COLLECTION_VERSIONS_ID},
+            {"$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    return f'W/"{versions["epoch"]}-{versions.get(collection_name, 0)}"'
+
+# ==================== DASHBOARD COUNTERS ====================
+
+# Dashboard numbers are kept in small counter documents in db.counters and
+# updated with $inc by the routes that change them: one "totals" document and
+# one "scheduled:<date>" document per appointment date.
+TOTALS_COUNTER_ID = "totals"
+# The counters and the doctor schedules must agree on which appointments count
+SCHEDULED_FILTER = {"status": "scheduled"}
+
+def is_scheduled(appointment: dict) -> bool:
+    return appointment.get('status') == "scheduled"
+
+def scheduled_counter_id(appointment_date: str) -> str:
+    return f"scheduled:{appointment_date}"
+
+async def increment_counter(counter_id: str, field: str, amount: int):
+    await db.counters.update_one({"_id": counter_id}, {"$inc": {field: amount}}, upsert=True)
+
+async def track_scheduled(appointment: dict, amount: int):
+    """Adjust the per-date scheduled count if the appointment is scheduled."""
+    if is_scheduled(appointment):
+        await increment_counter(scheduled_counter_id(appointment['appointment_date']), "count", amount)
+
+async def rebuild_dashboard_counters() -> DashboardStats:
+    """Recompute all counter documents from the source collections."""
+    total_patients = await db.patients.count_documents({})
+    total_appointments = await db.appointments.count_documents({})
+    scheduled = await db.appointments.aggregate([
+        {"$match": SCHEDULED_FILTER},
+        {"$group": {"_id": "$appointment_date", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    
+    # Overwrite in place rather than delete and reinsert: a write route's
+    # upserting $inc landing in between would otherwise hit a duplicate key
+    counters = [{"_id": TOTALS_COUNTER_ID, "patients": total_patients, "appointments": total_appointments}]
+    counters += [{"_id": scheduled_counter_id(s['_id']), "count": s['count']} for s in scheduled]
+    await db.counters.bulk_write([ReplaceOne({"_id": c['_id']}, c, upsert=True) for c in counters], ordered=False)
+    await db.counters.delete_many({
+        "_id": {"$regex": f"^{re.escape(scheduled_counter_id(''))}", "$nin": [c['_id'] for c in counters]}
+    })
+    
+    logger.info(f"Rebuilt dashboard counters: {total_patients} patients, {total_appointments} appointments")
+    return await read_dashboard_stats()
+
+async def read_dashboard_stats() -> DashboardStats:
+    today_id = scheduled_counter_id(datetime.now(timezone.utc).date().isoformat())
+    docs = await db.counters.find({"_id": {"$in": [TOTALS_COUNTER_ID, today_id]}}).to_list(2)
+    by_id = {d['_id']: d for d in docs}
+    totals = by_id.get(TOTALS_COUNTER_ID, {})
+    return DashboardStats(
+        total_patients=totals.get('patients', 0),
+        total_appointments=totals.get('appointments', 0),
+        today_appointments=by_id.get(today_id, {}).get('count', 0)
+    )
+
+# ==================== CHANGE FEED ====================
+
+# Appointment and patient changes are pushed to /ws/changes subscribers. With
+# CHANGE_FEED_SOURCE=change_stream each worker tails one MongoDB change stream
+# (so every worker sees writes made by any other) and fans it out to its own
+# sockets; standalone servers without change streams fall back to "local",
+# where the write routes publish their own changes in-process. Recent events
+# are kept so a reconnecting client can resume after the last id it saw; if
+# that id is gone, or a client falls CHANGE_FEED_QUEUE_SIZE events behind, it
+# gets a `reset` message and should reload.
+CHANGE_FEED_COLLECTIONS = {"appointments": Appointment, "patients": Patient}
+CHANGE_OPERATIONS = {"insert": "created", "replace": "updated", "update": "updated", "delete": "deleted"}
+RESET_MESSAGE = json.dumps({"type": "reset"})
+
+def change_document(collection: str, doc: Optional[dict]) -> Optional[dict]:
+    if doc is None:
+        return None
+    return {field: doc[field] for field in CHANGE_FEED_COLLECTIONS[collection].model_fields if field in doc}
+
+class ChangeSubscription:
+    def __init__(self, collections: set, doctor_name: Optional[str] = None, date: Optional[str] = None):
+        self.collections = collections
+        self.doctor_name = doctor_name
+        self.date = date
+        self.queue = asyncio.Queue(maxsize=CHANGE_FEED_QUEUE_SIZE)
+    
+    def matches(self, event: dict) -> bool:
+        if event['collection'] not in self.collections:
+            return False
+        if event['collection'] != "appointments" or not (self.doctor_name or self.date):
+            return True
+        # Match on the old version too, so an appointment moved out of the
+        # filter reaches the client that needs to drop it
+        docs = [doc for doc in (event['document'], event['previous']) if doc]
+        return not docs or any(
+            (not self.doctor_name or doc.get('doctor_name') == self.doctor_name)
+            and (not self.date or doc.get('appointment_date') == self.date)
+            for doc in docs
+        )
+    
+    def push(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too far behind to catch up event by event
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET_MESSAGE)
+
+class ChangeFeed:
+    def __init__(self, source: str):
+        self.source = source
+        self.pre_images = False
+        self.epoch = uuid.uuid4().hex[:8]
+        self.sequence = 0
+        self.history = deque(maxlen=CHANGE_FEED_HISTORY)
+        self.subscribers = set()
+        self.task = None
+    
+    async def start(self):
+        if self.source != "change_stream":
+            logger.info("Change feed: in-process")
+            return
+        
+        # Pre-images give delete events the deleted document (MongoDB 6.0+)
+        try:
+            for collection_name in CHANGE_FEED_COLLECTIONS:
+                await db.command({"collMod": collection_name, "changeStreamPreAndPostImages": {"enabled": True}})
+            self.pre_images = True
+        except OperationFailure as e:
+            logger.warning(f"Change stream pre-images unavailable, deletes will ask clients to reload: {str(e)}")
+        
+        try:
+            stream = self.open_stream()
+            # Opens the cursor, which fails right away on servers without change streams
+            change = await stream.try_next()
+        except OperationFailure as e:
+            logger.warning(f"Change streams unavailable, using the in-process change feed: {str(e)}")
+            self.source = "local"
+            return
+        if change is not None:
+            self.dispatch_change(change)
+        self.task = asyncio.create_task(self.watch(stream))
+        logger.info("Change feed: MongoDB change stream")
+    
+    def open_stream(self, resume_after: Optional[dict] = None):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(CHANGE_FEED_COLLECTIONS)},
+            "operationType": {"$in": list(CHANGE_OPERATIONS)}
+        }}]
+        options = {"full_document": "updateLookup", "resume_after": resume_after}
+        if self.pre_images:
+            options["full_document_before_change"] = "whenAvailable"
+        return db.watch(pipeline, **options)
+    
+    async def watch(self, stream):
+        while True:
+            try:
+                async with stream:
+                    async for change in stream:
+                        self.dispatch_change(change)
+            except PyMongoError as e:
+                logger.warning(f"Change stream interrupted, reopening: {str(e)}")
+                await asyncio.sleep(1)
+            except Exception:
+                # Anything else, e.g. a change that cannot be encoded, would
+                # otherwise end the task and silently stop every subscriber.
+                # The resume token is already past the failing change.
+                logger.exception("Change stream failed, reopening")
+                await asyncio.sleep(1)
+            stream = self.open_stream(resume_after=stream.resume_token)
+    
+    def dispatch_change(self, change: dict):
+        self.publish(
+            change['ns']['coll'],
+            CHANGE_OPERATIONS[change['operationType']],
+            change.get('fullDocument'),
+            change.get('fullDocumentBeforeChange'),
+            event_id=change['_id']['_data']
+        )
+    
+    def notify(self, collection: str, operation: str, document: Optional[dict], previous: Optional[dict] = None):
+        """Called by the write routes; a change stream reports the write itself."""
+        if self.source == "local":
+            self.publish(collection, operation, document, previous)
+    
+    def publish(self, collection: str, operation: str, document: Optional[dict], previous: Optional[dict] = None, event_id: Optional[str] = None):
+        if event_id is None:
+            self.sequence += 1
+            event_id = f"{self.epoch}-{self.sequence}"
+        event = {
+            "collection": collection,
+            "document": change_document(collection, document),
+            "previous": change_document(collection, previous)
+        }
+        known = event['document'] or event['previous'] or {}
+        # Encoded once and shared by every subscriber
+        message = orjson.dumps({
+            "type": "change",
+            "id": event_id,
+            "collection": collection,
+            "operation": operation,
+            "document_id": known.get('id'),
+            "document": event['document']
+        }, option=orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC).decode()
+        
+        self.history.append((event_id, event, message))
+        for subscription in self.subscribers:
+            if subscription.matches(event):
+                subscription.push(message)
+    
+    def subscribe(self, subscription: ChangeSubscription, resume_after: Optional[str] = None) -> bool:
+        """Register a subscription, replaying buffered events after resume_after.
+        
+        Returns False if resume_after is no longer buffered.
+        """
+        self.subscribers.add(subscription)
+        if resume_after is None:
+            return True
+        ids = [event_id for event_id, _, _ in self.history]
+        if resume_after not in ids:
+            return False
+        for _, event, message in list(self.history)[ids.index(resume_after) + 1:]:
+            if subscription.matches(event):
+                subscription.push(message)
+        return True
+    
+    def unsubscribe(self, subscription: ChangeSubscription):
+        self.subscribers.discard(subscription)
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+change_feed = ChangeFeed(CHANGE_FEED_SOURCE)
+
+# ==================== PATIENT SEARCH ====================
+
+# Fuzzy search over names, email and phone. Each patient document stores the
+# grams of those fields in `search_grams` (multikey-indexed, rewritten on
+# every create/update): trigrams, a two-character prefix so one-letter
+# queries match, and a sorted-letters key per word so transposed letters
+# ("jhon") still match. Every word of a query must match on its own: a
+# patient needs the similarity threshold of that word's grams (all of them
+# for words with digits, which have no typo tolerance), so a shared email
+# domain or phone prefix cannot qualify a match by itself. Matches rank by
+# the total number of query grams they contain. Only patients holding one of
+# the rarest grams of the most selective word are fetched as candidates,
+# which is enough to find every match without scanning common grams like
+# "ail" or "com".
+# Lower-cased copies of the names back the list route's name-prefix filter.
+# These fields are never returned to clients.
+PATIENT_SEARCH_FIELDS = ("first_name", "last_name", "email", "phone")
+# Bumped when the grams change, so the backfill rewrites older patients
+PATIENT_SEARCH_VERSION = 1
+PATIENT_PROJECTION = {"_id": 0, "search_grams": 0, "search_version": 0, "first_name_lower": 0, "last_name_lower": 0}
+
+search_gram_counts = TTLCache(maxsize=100_000, ttl=PATIENT_SEARCH_STATS_TTL)
+
+def search_tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def token_grams(token: str, closed: bool = True) -> set:
+    # Pad the start (and, for complete words, the end) so short tokens and
+    # word boundaries produce grams; an open end lets a typed prefix match.
+    padded = f" {token} " if closed else f" {token}"
+    grams = {padded[:2]} | {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+    if len(token) >= 3 and token.isalpha():
+        grams.add("~" + "".join(sorted(token)))
+    return grams
+
+def patient_search_grams(doc: dict) -> List[str]:
+    grams = set()
+    for field in PATIENT_SEARCH_FIELDS:
+        for token in search_tokens(doc.get(field) or ""):
+            grams |= token_grams(token)
+    return sorted(grams)
+
+def patient_search_fields(doc: dict) -> dict:
+    """The derived fields stored alongside a patient's own."""
+    return {
+        "search_grams": patient_search_grams(doc),
+        "search_version": PATIENT_SEARCH_VERSION,
+        "first_name_lower": (doc.get('first_name') or "").lower(),
+        "last_name_lower": (doc.get('last_name') or "").lower(),
+    }
+
+def query_search_terms(query: str) -> List[tuple]:
+    """(grams, min_score) for each word of a query; the last word may be a prefix."""
+    tokens = search_tokens(query)
+    terms = []
+    for i, token in enumerate(tokens):
+        grams = sorted(token_grams(token, closed=i < len(tokens) - 1))
+        if token.isalpha():
+            min_score = max(1, math.ceil(len(grams) * PATIENT_SEARCH_MIN_SIMILARITY))
+        else:
+            min_score = len(grams)
+        terms.append((grams, min_score))
+    return terms
+
+async def count_search_grams(grams: List[str]) -> dict:
+    """How many patients hold each gram, capped at PATIENT_SEARCH_MAX_CANDIDATES and cached."""
+    counts = {gram: search_gram_counts[gram] for gram in grams if gram in search_gram_counts}
+    missing = [gram for gram in grams if gram not in counts]
+    found = await asyncio.gather(*(
+        db.patients.count_documents({"search_grams": gram}, limit=PATIENT_SEARCH_MAX_CANDIDATES)
+        for gram in missing
+    ))
+    for gram, count in zip(missing, found):
+        counts[gram] = search_gram_counts[gram] = count
+    return counts
+
+async def candidate_search_grams(terms: List[tuple]) -> List[str]:
+    # A patient sharing min_score of a word's n grams must hold at least one
+    # of any n - min_score + 1 of them. Every word must match, so the rarest
+    # such grams of whichever word has the fewest holders are enough.
+    counts = await count_search_grams(sorted({gram for grams, _ in terms for gram in grams}))
+    best = None
+    for grams, min_score in terms:
+        rarest = sorted(grams, key=lambda gram: counts[gram])[:len(grams) - min_score + 1]
+        holders = sum(counts[gram] for gram in rarest)
+        if best is None or holders < best[0]:
+            best = (holders, rarest)
+    return best[1]
+
+async def backfill_patient_search_grams():
+    """Rewrite the search fields of patients written by an older version."""
+    updates = []
+    query = {"search_version": {"$ne": PATIENT_SEARCH_VERSION}}
+    async for doc in db.patients.find(query, {"_id": 1, **{f: 1 for f in PATIENT_SEARCH_FIELDS}}):
+        updates.append(UpdateOne({"_id": doc['_id']}, {"$set": patient_search_fields(doc)}))
+        if len(updates) >= BULK_IMPORT_BATCH_SIZE:
+            await db.patients.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db.patients.bulk_write(updates, ordered=False)
+
+# ==================== BULK IMPORT / EXPORT ====================
+
+PATIENT_EXPORT_FIELDS = list(Patient.model_fields)
+
+async def iter_lines(request: Request) -> AsyncIterator[str]:
+    """Yield decoded lines from a streamed request body."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def iter_ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[tuple]:
+    """Yield (row_number, record_or_error) for each non-blank NDJSON line."""
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            yield row, record
+        except ValueError as e:
+            yield row, ValueError(f"Invalid JSON: {str(e)}")
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[tuple]:
+    """Yield (row_number, record) for each CSV data row, keyed by the header row."""
+    header = None
+    row = 0
+    pending = ""
+    async for line in lines:
+        # Quoted fields may contain newlines; wait until quotes are balanced
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            continue
+        record_line, pending = pending, ""
+        if not record_line.strip():
+            continue
+        values = next(csv.reader([record_line]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        row += 1
+        yield row, {k: v for k, v in zip(header, values) if v != ""}
+
+def describe_validation_error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+async def insert_patient_batch(batch: List[tuple], result: BulkImportResult):
+    """Insert (row, doc) pairs unordered, recording per-row failures."""
+    docs = [doc for _, doc in batch]
+    try:
+        inserted = len((await db.patients.insert_many(docs, ordered=False)).inserted_ids)
+        failed = set()
+    except BulkWriteError as e:
+        inserted = e.details.get('nInserted', 0)
+        failed = {write_error['index'] for write_error in e.details.get('writeErrors', [])}
+        for write_error in e.details.get('writeErrors', []):
+            record_import_error(result, batch[write_error['index']][0], write_error.get('errmsg', 'Write failed'))
+    for index, doc in enumerate(docs):
+        if index not in failed:
+            change_feed.notify("patients", "created", doc)
+    result.inserted += inserted
+    if inserted:
+        await increment_counter(TOTALS_COUNTER_ID, "patients", inserted)
+        await bump_collection_version("patients")
+
+def record_import_error(result: BulkImportResult, row: int, error: str):
+    result.failed += 1
+    if len(result.errors) < BULK_IMPORT_MAX_ERRORS:
+        result.errors.append(BulkImportError(row=row, error=error))
+    else:
+        result.errors_truncated = True
+
+def export_csv_row(values: list) -> str:
+    buffer = io.StringIO()
+    # Timestamps in the same ISO-8601 form the API returns
+    csv.writer(buffer).writerow([
+        orjson.dumps(value, option=FAST_JSON_OPTIONS).decode().strip('"') if isinstance(value, datetime) else value
+        for value in values
+    ])
+    return buffer.getvalue()
+
+# ==================== SCHEDULING ====================
+
+# Each doctor's bookings for a day live in one db.doctor_schedules document
+# holding the sorted [start, end) minute intervals of their scheduled
+# appointments. Bookings are checked against that list and written back with
+# a compare-and-swap on `version`, so two concurrent requests can never both
+# claim overlapping time. Availability is computed from the same documents.
+
+def parse_minutes(value: str) -> int:
+    try:
+        parsed = datetime.strptime(value, "%H:%M")
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail=f"Invalid time '{value}', expected HH:MM")
+    return parsed.hour * 60 + parsed.minute
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def validate_date(value: str) -> str:
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail=f"Invalid date '{value}', expected YYYY-MM-DD")
+    return value
+
+def schedule_id(doctor_name: str, date: str) -> str:
+    return f"{doctor_name}|{date}"
+
+def appointment_interval(appointment: dict) -> tuple:
+    start = parse_minutes(appointment['appointment_time'])
+    end = start + appointment.get('duration_minutes', DEFAULT_APPOINTMENT_MINUTES)
+    if end > 24 * 60:
+        raise HTTPException(status_code=422, detail="Appointment must end on the same day")
+    return start, end
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(validate_date(value), "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+def appointment_bounds(appointment: dict) -> dict:
+    """Typed start/end of the appointment, stored for indexed range queries.
+    
+    Clinic wall-clock date and time are stored as-is in UTC, matching how
+    appointment_date and appointment_time are entered.
+    """
+    start, end = appointment_interval(appointment)
+    day = parse_date(appointment['appointment_date'])
+    return {"starts_at": day + timedelta(minutes=start), "ends_at": day + timedelta(minutes=end)}
+
+async def reserve_interval(appointment: dict):
+    """Book the appointment's interval, replacing any interval it already holds that day."""
+    doctor_name, date = appointment['doctor_name'], validate_date(appointment['appointment_date'])
+    start, end = appointment_interval(appointment)
+    key = schedule_id(doctor_name, date)
+    
+    for _ in range(SCHEDULE_MAX_RETRIES):
+        schedule = await db.doctor_schedules.find_one({"_id": key})
+        intervals = [i for i in (schedule or {}).get('intervals', []) if i['appointment_id'] != appointment['id']]
+        for interval in intervals:
+            if interval['start'] < end and start < interval['end']:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"{doctor_name} is already booked from {format_minutes(interval['start'])} "
+                           f"to {format_minutes(interval['end'])} on {date}"
+                )
+        
+        intervals.append({
+            "start": start, "end": end, "appointment_id": appointment['id'],
+            "reserved_at": datetime.now(timezone.utc)
+        })
+        intervals.sort(key=lambda i: i['start'])
+        
+        if schedule is None:
+            try:
+                await db.doctor_schedules.insert_one(
+                    {"_id": key, "doctor_name": doctor_name, "date": date, "intervals": intervals, "version": 1}
+                )
+                return
+            except DuplicateKeyError:
+                continue
+        
+        result = await db.doctor_schedules.update_one(
+            {"_id": key, "version": schedule['version']},
+            {"$set": {"intervals": intervals}, "$inc": {"version": 1}}
+        )
+        if result.modified_count:
+            return
+    
+    raise HTTPException(status_code=503, detail="Schedule is busy, please retry", headers={"Retry-After": "1"})
+
+async def release_interval(appointment: dict):
+    await db.doctor_schedules.update_one(
+        {"_id": schedule_id(appointment['doctor_name'], appointment['appointment_date'])},
+        {"$pull": {"intervals": {"appointment_id": appointment['id']}}, "$inc": {"version": 1}}
+    )
+
+SCHEDULE_FIELDS = {"appointment_date", "appointment_time", "duration_minutes", "status"}
+
+def moves_day(before: dict, after: dict) -> bool:
+    return before['appointment_date'] != after['appointment_date']
+
+async def apply_schedule_change(before: dict, after: dict):
+    if is_scheduled(after):
+        await reserve_interval(after)
+        if is_scheduled(before) and moves_day(before, after):
+            await release_interval(before)
+    elif is_scheduled(before):
+        await release_interval(before)
+
+async def resync_schedule(attempted: dict):
+    """Make the schedule match the stored appointment after a lost update.
+    
+    The write that won may have reserved its interval before ours replaced
+    it, so restoring what we read is not enough: book whatever the appointment
+    now holds, and repeat if it changes again meanwhile.
+    """
+    for _ in range(SCHEDULE_MAX_RETRIES):
+        current = await db.appointments.find_one({"id": attempted['id']}, {"_id": 0})
+        if is_scheduled(attempted) and (
+            current is None or not is_scheduled(current) or moves_day(attempted, current)
+        ):
+            await release_interval(attempted)
+        if current is None:
+            return
+        if is_scheduled(current):
+            try:
+                await reserve_interval(current)
+            except HTTPException as e:
+                logger.warning(f"Could not restore slot for appointment {current['id']}: {e.detail}")
+                return
+        
+        # Changed or deleted meanwhile: the next pass undoes what we just booked
+        latest = await db.appointments.find_one({"id": current['id']}, {"_id": 0, "version": 1})
+        if latest is not None and latest['version'] == current['version']:
+            return
+        attempted = current
+    logger.warning(f"Schedule for appointment {attempted['id']} may be stale; the next orphan sweep repairs it")
+
+def holds_interval(appointment: Optional[dict], schedule: dict, interval: dict) -> bool:
+    if appointment is None or not is_scheduled(appointment):
+        return False
+    if schedule_id(appointment['doctor_name'], appointment['appointment_date']) != schedule['_id']:
+        return False
+    try:
+        return appointment_interval(appointment) == (interval['start'], interval['end'])
+    except HTTPException:
+        return False
+
+async def drop_phantom_intervals() -> int:
+    """Pull intervals that no stored appointment holds.
+    
+    A booking that crashed between reserving its slot and saving, or an
+    update that failed after moving the slot, leaves an interval behind that
+    blocks the slot for good. Recent intervals are skipped because their
+    booking may still be in flight.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=SCHEDULE_INTERVAL_GRACE)
+    dropped = 0
+    async for schedule in db.doctor_schedules.find({"intervals.0": {"$exists": True}}):
+        settled = [i for i in schedule['intervals'] if i.get('reserved_at') is None or i['reserved_at'] <= cutoff]
+        if not settled:
+            continue
+        holders = {
+            a['id']: a for a in await db.appointments.find(
+                {"id": {"$in": [i['appointment_id'] for i in settled]}}, {"_id": 0}
+            ).to_list(None)
+        }
+        phantoms = [i['appointment_id'] for i in settled if not holds_interval(holders.get(i['appointment_id']), schedule, i)]
+        if not phantoms:
+            continue
+        # Conditional on the version read; a schedule changed meanwhile waits for the next sweep
+        result = await db.doctor_schedules.update_one(
+            {"_id": schedule['_id'], "version": schedule['version']},
+            {"$pull": {"intervals": {"appointment_id": {"$in": phantoms}}}, "$inc": {"version": 1}}
+        )
+        if result.modified_count:
+            logger.warning(f"Dropped {len(phantoms)} phantom intervals from schedule {schedule['_id']}")
+            dropped += len(phantoms)
+    return dropped
+
+async def rebuild_doctor_schedules():
+    """Recreate all schedule documents from scheduled appointments."""
+    schedules = {}
+    async for appointment in db.appointments.find(SCHEDULED_FILTER, {"_id": 0}):
+        try:
+            start, end = appointment_interval(appointment)
+        except HTTPException:
+            logger.warning(f"Skipping appointment {appointment['id']} with invalid time for scheduling")
+            continue
+        key = schedule_id(appointment['doctor_name'], appointment['appointment_date'])
+        schedule = schedules.setdefault(key, {
+            "_id": key,
+            "doctor_name": appointment['doctor_name'],
+            "date": appointment['appointment_date'],
+            "intervals": [],
+            "version": 1
+        })
+        schedule['intervals'].append({"start": start, "end": end, "appointment_id": appointment['id']})
+    
+    for schedule in schedules.values():
+        schedule['intervals'].sort(key=lambda i: i['start'])
+    await db.doctor_schedules.delete_many({})
+    if schedules:
+        await db.doctor_schedules.insert_many(list(schedules.values()))
+    logger.info(f"Rebuilt {len(schedules)} doctor schedules")
+
+async def ensure_doctor_schedules():
+    # Appointments created before scheduling existed have no schedule documents
+    if await db.doctor_schedules.estimated_document_count() == 0 and await db.appointments.find_one({}):
+        await rebuild_doctor_schedules()
+
+def free_slots(intervals: List[dict], day_start: int, day_end: int, slot_minutes: int) -> List[str]:
+    slots = []
+    cursor = day_start
+    for interval in sorted(intervals, key=lambda i: i['start']) + [{"start": day_end, "end": day_end}]:
+        while cursor + slot_minutes <= min(interval['start'], day_end):
+            slots.append(format_minutes(cursor))
+            cursor += slot_minutes
+        if interval['end'] > cursor:
+            # Resume on the slot grid, at the first slot after the booking ends
+            cursor = day_start + math.ceil((interval['end'] - day_start) / slot_minutes) * slot_minutes
+    return slots
+
+# ==================== BACKGROUND JOBS ====================
+
+# Slow maintenance work runs outside the request as jobs recorded in db.jobs,
+# which doubles as their progress report. A job is run by whichever worker
+# holds its lease; the lease is renewed after every batch, so a job whose
+# worker died is picked up again at the next startup. Runners must tolerate
+# being re-run from the start.
+
+async def enqueue_job(job_type: str, params: dict, job_id: Optional[str] = None) -> dict:
+    """Record a job and start it in the background; a fixed job_id makes enqueueing idempotent."""
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": job_id or str(uuid.uuid4()),
+        "type": job_type,
+        "status": "queued",
+        "params": params,
+        "progress": {},
+        "created_at": now,
+        "updated_at": now,
+        "lease_until": now
+    }
+    await db.jobs.insert_one(dict(job))
+    spawn_background(run_job(job['id']))
+    return job
+
+async def claim_job(job_id: str) -> Optional[dict]:
+    now = datetime.now(timezone.utc)
+    return await db.jobs.find_one_and_update(
+        {"id": job_id, "status": {"$in": ["queued", "running"]}, "lease_until": {"$lte": now}},
+        {"$set": {
+            "status": "running",
+            "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+            "updated_at": now
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def report_progress(job: dict, **progress: int):
+    """Record progress counters and renew the lease."""
+    now = datetime.now(timezone.utc)
+    job['progress'].update(progress)
+    await db.jobs.update_one(
+        {"id": job['id']},
+        {"$set": {
+            "progress": job['progress'],
+            "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+            "updated_at": now
+        }}
+    )
+
+async def finish_job(job: dict, status: str, error: Optional[str] = None):
+    now = datetime.now(timezone.utc)
+    await db.jobs.update_one(
+        {"id": job['id']},
+        {"$set": {"status": status, "error": error, "updated_at": now, "finished_at": now}}
+    )
+
+async def run_job(job_id: str):
+    job = await claim_job(job_id)
+    if job is None:
+        # Finished, or another worker holds the lease
+        return
+    try:
+        await JOB_RUNNERS[job['type']](job)
+    except Exception as e:
+        logger.error(f"Job {job_id} ({job['type']}) failed: {str(e)}")
+        await finish_job(job, "failed", str(e))
+        return
+    await finish_job(job, "completed")
+    logger.info(f"Job {job_id} ({job['type']}) completed: {job['progress']}")
+
+async def resume_jobs():
+    """Restart jobs left queued or running by a worker that went away."""
+    stalled = await db.jobs.find(
+        {"status": {"$in": ["queued", "running"]}, "lease_until": {"$lte": datetime.now(timezone.utc)}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+    for job in stalled:
+        spawn_background(run_job(job['id']))
+    if stalled:
+        logger.info(f"Resuming {len(stalled)} background jobs")
+
+async def remove_appointments(appointments: List[dict], reason: str) -> int:
+    """Archive (if enabled) and delete appointments, undoing their counters and bookings."""
+    if ARCHIVE_DELETED_APPOINTMENTS:
+        archived_at = datetime.now(timezone.utc)
+        try:
+            await db.archived_appointments.insert_many(
+                [{**a, "archived_at": archived_at, "archive_reason": reason} for a in appointments],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Already archived by an earlier, interrupted run
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+    
+    result = await db.appointments.delete_many({"id": {"$in": [a['id'] for a in appointments]}})
+    if result.deleted_count:
+        await increment_counter(TOTALS_COUNTER_ID, "appointments", -result.deleted_count)
+        await bump_collection_version("appointments")
+    if result.deleted_count == len(appointments):
+        scheduled = {}
+        for a in appointments:
+            if is_scheduled(a):
+                scheduled[a['appointment_date']] = scheduled.get(a['appointment_date'], 0) + 1
+        for appointment_date, count in scheduled.items():
+            await increment_counter(scheduled_counter_id(appointment_date), "count", -count)
+    else:
+        # Some were deleted concurrently, and those deletes already adjusted their dates
+        logger.warning("Appointments deleted concurrently; rebuild dashboard counters if per-day counts drift")
+    
+    # Freeing a slot is idempotent, so release all of them regardless
+    booked = {}
+    for a in appointments:
+        if is_scheduled(a):
+            booked.setdefault(schedule_id(a['doctor_name'], a['appointment_date']), []).append(a['id'])
+    if booked:
+        await db.doctor_schedules.bulk_write([
+            UpdateOne({"_id": key}, {"$pull": {"intervals": {"appointment_id": {"$in": ids}}}, "$inc": {"version": 1}})
+            for key, ids in booked.items()
+        ], ordered=False)
+    
+    for a in appointments:
+        change_feed.notify("appointments", "deleted", None, a)
+    return result.deleted_count
+
+async def run_patient_cascade(job: dict):
+    """Remove every appointment of a deleted patient, a batch at a time."""
+    patient_id = job['params']['patient_id']
+    removed = job['progress'].get('removed', 0)
+    await report_progress(job, total=removed + await db.appointments.count_documents({"patient_id": patient_id}))
+    
+    while True:
+        batch = await db.appointments.find({"patient_id": patient_id}, {"_id": 0}).limit(JOB_BATCH_SIZE).to_list(JOB_BATCH_SIZE)
+        if not batch:
+            break
+        removed += await remove_appointments(batch, "patient_deleted")
+        await report_progress(job, removed=removed)
+
+async def run_orphan_sweep(job: dict):
+    """Walk all appointments by id, removing orphans and fixing stale patient_name copies,
+    then drop schedule intervals left behind by failed bookings."""
+    scanned = orphans_removed = names_repaired = 0
+    last_id = None
+    
+    while True:
+        query = {"id": {"$gt": last_id}} if last_id else {}
+        batch = await db.appointments.find(query, {"_id": 0}).sort("id", ASCENDING).limit(JOB_BATCH_SIZE).to_list(JOB_BATCH_SIZE)
+        if not batch:
+            break
+        last_id = batch[-1]['id']
+        
+        patients = await db.patients.find(
+            {"id": {"$in": list({a['patient_id'] for a in batch})}},
+            {"_id": 0, "id": 1, "first_name": 1, "last_name": 1}
+        ).to_list(None)
+        names = {p['id']: f"{p['first_name']} {p['last_name']}" for p in patients}
+        
+        orphans = [a for a in batch if a['patient_id'] not in names]
+        if orphans:
+            orphans_removed += await remove_appointments(orphans, "orphaned")
+        
+        stale = [a for a in batch if a['patient_id'] in names and a.get('patient_name') != names[a['patient_id']]]
+        if stale:
+            # Conditional on the version read, so a concurrent edit is left for the next sweep
+            result = await db.appointments.bulk_write([
+                UpdateOne(
+                    {"id": a['id'], "version": a['version']},
+                    {"$set": {"patient_name": names[a['patient_id']]}, "$inc": {"version": 1}}
+                )
+                for a in stale
+            ], ordered=False)
+            names_repaired += result.modified_count
+            if result.modified_count:
+                await bump_collection_version("appointments")
+                # Re-read to publish only the rows this sweep actually changed
+                before = {a['id']: a for a in stale}
+                async for doc in db.appointments.find({"id": {"$in": list(before)}}, {"_id": 0}):
+                    previous = before[doc['id']]
+                    if doc['version'] == previous['version'] + 1 and doc.get('patient_name') == names.get(doc['patient_id']):
+                        change_feed.notify("appointments", "updated", doc, previous)
+        
+        scanned += len(batch)
+        await report_progress(job, scanned=scanned, orphans_removed=orphans_removed, names_repaired=names_repaired)
+    
+    await report_progress(job, intervals_dropped=await drop_phantom_intervals())
+
+JOB_RUNNERS = {
+    "patient_cascade": run_patient_cascade,
+    "orphan_sweep": run_orphan_sweep,
+}
+
+async def schedule_orphan_sweeps():
+    """Enqueue one sweep per interval; the interval-based job id lets only one worker enqueue it."""
+    while True:
+        await asyncio.sleep(ORPHAN_SWEEP_INTERVAL)
+        try:
+            await enqueue_job("orphan_sweep", {}, job_id=f"orphan_sweep:{int(time.time() // ORPHAN_SWEEP_INTERVAL)}")
+        except DuplicateKeyError:
+            continue
+        except PyMongoError as e:
+            logger.warning(f"Could not schedule orphan sweep: {str(e)}")
+
+sweeper_tasks = set()
 
 # ==================== AUTH ROUTES ====================
 
-@api_router.post("/auth/register", response_model=Token)
+@api_router.post("/auth/register", response_model=Token, dependencies=[Depends(rate_limit_by_account("auth", "auth_ip"))])
 async def register(user_data: UserCreate):
     # Check if user exists
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
+    if user_data.role == "admin" and user_data.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin accounts cannot be self-registered")
     
     # Create user
     user = User(
@@ -187,25 +2137,33 @@ async def register(user_data: UserCreate):
     )
     
     user_dict = user.model_dump()
-    user_dict['password'] = hash_password(user_data.password)
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
+    user_dict['password'] = await hash_password(user_data.password)
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # A concurrent registration with the same email got there first
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create token
     access_token = create_access_token(data={"sub": user.id})
     
     return Token(access_token=access_token, token_type="bearer", user=user)
 
-@api_router.post("/auth/login", response_model=Token)
+@api_router.post("/auth/login", response_model=Token, dependencies=[Depends(rate_limit_by_account("auth", "auth_ip"))])
 async def login(credentials: UserLogin):
     user_doc = await db.users.find_one({"email": credentials.email})
     if not user_doc:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    if not verify_password(credentials.password, user_doc['password']):
+    valid, new_hash = await verify_and_update_password(credentials.password, user_doc['password'])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    # Transparently upgrade hashes created with a different bcrypt cost
+    if new_hash:
+        await db.users.update_one({"id": user_doc['id']}, {"$set": {"password": new_hash}})
+    
     user = User(**{k: v for k, v in user_doc.items() if k != 'password'})
     access_token = create_access_token(data={"sub": user.id})
     
@@ -218,144 +2176,507 @@ async def get_me(current_user: User = Depends(get_current_user)):
 # ==================== PATIENT ROUTES ====================
 
 @api_router.post("/patients", response_model=Patient)
-async def create_patient(patient_data: PatientCreate, current_user: User = Depends(get_current_user)):
+async def create_patient(patient_data: PatientCreate, response: Response, current_user: User = Depends(get_current_user)):
     patient = Patient(**patient_data.model_dump())
     
     doc = patient.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
+    doc.update(patient_search_fields(doc))
     
     await db.patients.insert_one(doc)
+    await increment_counter(TOTALS_COUNTER_ID, "patients", 1)
+    await bump_collection_version("patients")
+    change_feed.notify("patients", "created", doc)
+    set_etag(response, doc)
     return patient
 
 @api_router.get("/patients", response_model=List[Patient])
-async def get_patients(current_user: User = Depends(get_current_user)):
-    patients = await db.patients.find({}, {"_id": 0}).to_list(1000)
+async def get_patients(
+    response: Response,
+    name: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    projection = fields_projection(Patient, fields)
+    etag = await collection_etag("patients")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, "patients")
+    
+    query = {}
+    if name:
+        query["$or"] = [{"first_name_lower": prefix_regex(name.lower())}, {"last_name_lower": prefix_regex(name.lower())}]
+    
+    patients = await fetch_page(db.patients, query, cursor, limit, response, projection or PATIENT_FIELDS_PROJECTION)
+    
+    set_cache_headers(response, etag, "patients")
+    return list_response(patients, response, partial=projection is not None)
+
+@api_router.get("/patients/search", response_model=List[Patient])
+async def search_patients(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    projection = fields_projection(Patient, fields)
+    terms = query_search_terms(q)
+    if not terms:
+        return []
     
-    for patient in patients:
-        if isinstance(patient.get('created_at'), str):
-            patient['created_at'] = datetime.fromisoformat(patient['created_at'])
-        if isinstance(patient.get('updated_at'), str):
-            patient['updated_at'] = datetime.fromisoformat(patient['updated_at'])
+    etag = await collection_etag("patients")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, "patient_search")
+    candidates = await candidate_search_grams(terms)
+    term_scores = {f"term_{i}": {"$size": {"$filter": {
+        "input": "$search_grams", "cond": {"$in": ["$$this", grams]}
+    }}} for i, (grams, _) in enumerate(terms)}
     
-    return patients
+    patients = await db.patients.aggregate([
+        {"$match": {"search_grams": {"$in": candidates}}},
+        {"$addFields": term_scores},
+        {"$match": {f"term_{i}": {"$gte": min_score} for i, (_, min_score) in enumerate(terms)}},
+        {"$addFields": {"score": {"$add": [f"${name}" for name in term_scores]}}},
+        {"$sort": {"score": -1, "last_name": 1, "first_name": 1}},
+        {"$limit": limit},
+        {"$project": projection or PATIENT_FIELDS_PROJECTION},
+    ]).to_list(limit)
+    
+    set_cache_headers(response, etag, "patient_search")
+    return list_response(patients, response, partial=projection is not None)
+
+@api_router.post("/patients/bulk", response_model=BulkImportResult)
+async def bulk_import_patients(request: Request, current_user: User = Depends(get_current_user)):
+    """Import patients from a streamed NDJSON body, or CSV with a header row when sent as text/csv."""
+    content_type = request.headers.get("content-type", "")
+    rows = iter_csv_rows(iter_lines(request)) if "csv" in content_type else iter_ndjson_rows(iter_lines(request))
+    
+    result = BulkImportResult(inserted=0, failed=0, errors=[])
+    batch = []
+    async for row, record in rows:
+        if isinstance(record, Exception):
+            record_import_error(result, row, str(record))
+            continue
+        try:
+            patient = Patient(**PatientCreate(**record).model_dump())
+        except ValidationError as e:
+            record_import_error(result, row, describe_validation_error(e))
+            continue
+        
+        doc = patient.model_dump()
+        doc.update(patient_search_fields(doc))
+        batch.append((row, doc))
+        
+        if len(batch) >= BULK_IMPORT_BATCH_SIZE:
+            await insert_patient_batch(batch, result)
+            batch = []
+    
+    if batch:
+        await insert_patient_batch(batch, result)
+    
+    logger.info(f"Bulk patient import: {result.inserted} inserted, {result.failed} failed")
+    return result
+
+@api_router.get("/patients/export")
+async def export_patients(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream every patient as NDJSON or CSV straight from a server-side cursor."""
+    async def export_stream():
+        if format == "csv":
+            yield export_csv_row(PATIENT_EXPORT_FIELDS)
+        cursor = db.patients.find({}, PATIENT_PROJECTION).sort(
+            [("created_at", ASCENDING), ("id", ASCENDING)]
+        ).batch_size(BULK_IMPORT_BATCH_SIZE)
+        async for doc in cursor:
+            if format == "csv":
+                yield export_csv_row([doc.get(field, "") for field in PATIENT_EXPORT_FIELDS])
+            else:
+                yield orjson.dumps(doc, option=FAST_JSON_OPTIONS | orjson.OPT_APPEND_NEWLINE).decode()
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="patients.{format}"'}
+    )
 
 @api_router.get("/patients/{patient_id}", response_model=Patient)
-async def get_patient(patient_id: str, current_user: User = Depends(get_current_user)):
-    patient = await db.patients.find_one({"id": patient_id}, {"_id": 0})
+async def get_patient(
+    patient_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    patient = await db.patients.find_one({"id": patient_id}, PATIENT_PROJECTION)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     
-    if isinstance(patient.get('created_at'), str):
-        patient['created_at'] = datetime.fromisoformat(patient['created_at'])
-    if isinstance(patient.get('updated_at'), str):
-        patient['updated_at'] = datetime.fromisoformat(patient['updated_at'])
-    
+    etag = item_etag(patient)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, "patient")
+    set_cache_headers(response, etag, "patient")
     return Patient(**patient)
 
-@api_router.put("/patients/{patient_id}", response_model=Patient)
-async def update_patient(patient_id: str, patient_data: PatientUpdate, current_user: User = Depends(get_current_user)):
-    existing_patient = await db.patients.find_one({"id": patient_id})
-    if not existing_patient:
+@api_router.get("/patients/{patient_id}/overview", response_model=PatientOverview)
+async def get_patient_overview(
+    patient_id: str,
+    upcoming_limit: int = Query(10, ge=1, le=100),
+    past_limit: int = Query(10, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """The patient with their next and most recent appointments and appointment counts, in one aggregation."""
+    now = datetime.now(timezone.utc)
+    appointment = {"$replaceRoot": {"newRoot": "$appointment"}}
+    overviews = await db.patients.aggregate([
+        {"$match": {"id": patient_id}},
+        {"$limit": 1},
+        # Served by the appointments.patient_id index; one document per
+        # appointment, or the patient alone if there are none
+        {"$lookup": {"from": "appointments", "localField": "id", "foreignField": "patient_id", "as": "appointment"}},
+        {"$unwind": {"path": "$appointment", "preserveNullAndEmptyArrays": True}},
+        {"$facet": {
+            "patient": [{"$limit": 1}, {"$project": {**PATIENT_PROJECTION, "appointment": 0}}],
+            "upcoming": [
+                {"$match": {"appointment.starts_at": {"$gte": now}}},
+                {"$sort": {"appointment.starts_at": 1}},
+                {"$limit": upcoming_limit},
+                appointment,
+                {"$project": APPOINTMENT_FIELDS_PROJECTION},
+            ],
+            "past": [
+                {"$match": {"appointment.starts_at": {"$lt": now}}},
+                {"$sort": {"appointment.starts_at": -1}},
+                {"$limit": past_limit},
+                appointment,
+                {"$project": APPOINTMENT_FIELDS_PROJECTION},
+            ],
+            "by_status": [
+                {"$match": {"appointment": {"$exists": True}}},
+                {"$group": {"_id": "$appointment.status", "count": {"$sum": 1}}},
+            ],
+            "upcoming_count": [{"$match": {"appointment.starts_at": {"$gte": now}}}, {"$count": "count"}],
+            "past_count": [{"$match": {"appointment.starts_at": {"$lt": now}}}, {"$count": "count"}],
+        }},
+    ]).to_list(1)
+    overview = overviews[0] if overviews else None
+    if not overview or not overview['patient']:
         raise HTTPException(status_code=404, detail="Patient not found")
     
-    update_data = {k: v for k, v in patient_data.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    by_status = {group['_id']: group['count'] for group in overview['by_status']}
+    upcoming = overview['upcoming_count'][0]['count'] if overview['upcoming_count'] else 0
+    past = overview['past_count'][0]['count'] if overview['past_count'] else 0
     
-    await db.patients.update_one({"id": patient_id}, {"$set": update_data})
+    return PatientOverview(
+        patient=Patient(**overview['patient'][0]),
+        upcoming_appointments=[Appointment(**a) for a in overview['upcoming']],
+        past_appointments=[Appointment(**a) for a in overview['past']],
+        appointment_counts=AppointmentCounts(
+            total=sum(by_status.values()), upcoming=upcoming, past=past, by_status=by_status
+        )
+    )
+
+@api_router.put("/patients/{patient_id}", response_model=Patient)
+async def update_patient(
+    patient_id: str,
+    patient_data: PatientUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    expected_version = parse_if_match(if_match)
+    update_data = {k: v for k, v in patient_data.model_dump().items() if v is not None}
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
-    updated_patient = await db.patients.find_one({"id": patient_id}, {"_id": 0})
-    if isinstance(updated_patient.get('created_at'), str):
-        updated_patient['created_at'] = datetime.fromisoformat(updated_patient['created_at'])
-    if isinstance(updated_patient.get('updated_at'), str):
-        updated_patient['updated_at'] = datetime.fromisoformat(updated_patient['updated_at'])
+    for _ in range(UPDATE_MAX_RETRIES):
+        query = versioned_filter(patient_id, expected_version)
+        if update_data.keys() & set(PATIENT_SEARCH_FIELDS):
+            # Search fields depend on the fields not being changed, so read
+            # first and only write if the document is still at that version
+            existing_patient = await db.patients.find_one(query, {"_id": 0, "version": 1, **{f: 1 for f in PATIENT_SEARCH_FIELDS}})
+            if existing_patient is None:
+                await raise_write_failure(db.patients, patient_id, expected_version, "Patient")
+            update_data.update(patient_search_fields({**existing_patient, **update_data}))
+            query["version"] = existing_patient['version']
+        
+        updated_patient = await db.patients.find_one_and_update(
+            query,
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection=PATIENT_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_patient is not None:
+            await bump_collection_version("patients")
+            change_feed.notify("patients", "updated", updated_patient)
+            set_etag(response, updated_patient)
+            return Patient(**updated_patient)
+        if expected_version is not None or 'search_grams' not in update_data:
+            await raise_write_failure(db.patients, patient_id, expected_version, "Patient")
     
-    return Patient(**updated_patient)
+    raise HTTPException(status_code=503, detail="Patient is being modified concurrently, please retry", headers={"Retry-After": "1"})
 
 @api_router.delete("/patients/{patient_id}")
-async def delete_patient(patient_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.patients.delete_one({"id": patient_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    return {"message": "Patient deleted successfully"}
+async def delete_patient(
+    patient_id: str,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    expected_version = parse_if_match(if_match)
+    deleted = await db.patients.find_one_and_delete(versioned_filter(patient_id, expected_version), PATIENT_PROJECTION)
+    if deleted is None:
+        await raise_write_failure(db.patients, patient_id, expected_version, "Patient")
+    await increment_counter(TOTALS_COUNTER_ID, "patients", -1)
+    await bump_collection_version("patients")
+    change_feed.notify("patients", "deleted", None, deleted)
+    
+    # Their appointments are removed in the background; poll /jobs/{job_id} for progress
+    job = await enqueue_job("patient_cascade", {"patient_id": patient_id})
+    return {"message": "Patient deleted successfully", "job_id": job['id']}
 
 # ==================== APPOINTMENT ROUTES ====================
 
 @api_router.post("/appointments", response_model=Appointment)
-async def create_appointment(appointment_data: AppointmentCreate, current_user: User = Depends(get_current_user)):
+async def create_appointment(appointment_data: AppointmentCreate, response: Response, current_user: User = Depends(get_current_user)):
     appointment = Appointment(**appointment_data.model_dump())
     
     doc = appointment.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc.update(appointment_bounds(doc))
     
-    await db.appointments.insert_one(doc)
+    await reserve_interval(doc)
+    try:
+        await db.appointments.insert_one(doc)
+    except Exception:
+        await release_interval(doc)
+        raise
+    await increment_counter(TOTALS_COUNTER_ID, "appointments", 1)
+    await track_scheduled(doc, 1)
+    await bump_collection_version("appointments")
+    change_feed.notify("appointments", "created", doc)
+    set_etag(response, doc)
     return appointment
 
 @api_router.get("/appointments", response_model=List[Appointment])
-async def get_appointments(current_user: User = Depends(get_current_user)):
-    appointments = await db.appointments.find({}, {"_id": 0}).to_list(1000)
+async def get_appointments(
+    response: Response,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    doctor_name: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    projection = fields_projection(Appointment, fields)
+    etag = await collection_etag("appointments")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, "appointments")
     
-    for appointment in appointments:
-        if isinstance(appointment.get('created_at'), str):
-            appointment['created_at'] = datetime.fromisoformat(appointment['created_at'])
+    query = {}
+    if date_from or date_to:
+        query["starts_at"] = {}
+        if date_from:
+            query["starts_at"]["$gte"] = parse_date(date_from)
+        if date_to:
+            query["starts_at"]["$lt"] = parse_date(date_to) + timedelta(days=1)
+    if status:
+        query["status"] = status
+    if doctor_name:
+        query["doctor_name"] = doctor_name
+    if patient_id:
+        query["patient_id"] = patient_id
     
-    return appointments
+    appointments = await fetch_page(db.appointments, query, cursor, limit, response, projection or APPOINTMENT_FIELDS_PROJECTION)
+    
+    set_cache_headers(response, etag, "appointments")
+    return list_response(appointments, response, partial=projection is not None)
 
 @api_router.get("/appointments/{appointment_id}", response_model=Appointment)
-async def get_appointment(appointment_id: str, current_user: User = Depends(get_current_user)):
+async def get_appointment(
+    appointment_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     appointment = await db.appointments.find_one({"id": appointment_id}, {"_id": 0})
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
-    if isinstance(appointment.get('created_at'), str):
-        appointment['created_at'] = datetime.fromisoformat(appointment['created_at'])
-    
+    etag = item_etag(appointment)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, "appointment")
+    set_cache_headers(response, etag, "appointment")
     return Appointment(**appointment)
 
 @api_router.put("/appointments/{appointment_id}", response_model=Appointment)
-async def update_appointment(appointment_id: str, appointment_data: AppointmentUpdate, current_user: User = Depends(get_current_user)):
-    existing_appointment = await db.appointments.find_one({"id": appointment_id})
-    if not existing_appointment:
-        raise HTTPException(status_code=404, detail="Appointment not found")
-    
+async def update_appointment(
+    appointment_id: str,
+    appointment_data: AppointmentUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    expected_version = parse_if_match(if_match)
     update_data = {k: v for k, v in appointment_data.model_dump().items() if v is not None}
     
-    await db.appointments.update_one({"id": appointment_id}, {"$set": update_data})
+    # Changes that leave the schedule alone are a single conditional write
+    if not update_data.keys() & SCHEDULE_FIELDS:
+        updated_appointment = await db.appointments.find_one_and_update(
+            versioned_filter(appointment_id, expected_version),
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_appointment is None:
+            await raise_write_failure(db.appointments, appointment_id, expected_version, "Appointment")
+        await bump_collection_version("appointments")
+        change_feed.notify("appointments", "updated", updated_appointment)
+        set_etag(response, updated_appointment)
+        return Appointment(**updated_appointment)
     
-    updated_appointment = await db.appointments.find_one({"id": appointment_id}, {"_id": 0})
-    if isinstance(updated_appointment.get('created_at'), str):
-        updated_appointment['created_at'] = datetime.fromisoformat(updated_appointment['created_at'])
+    for _ in range(UPDATE_MAX_RETRIES):
+        existing_appointment = await db.appointments.find_one(versioned_filter(appointment_id, expected_version), {"_id": 0})
+        if existing_appointment is None:
+            await raise_write_failure(db.appointments, appointment_id, expected_version, "Appointment")
+        
+        changes = dict(update_data)
+        if changes.keys() & {"appointment_date", "appointment_time", "duration_minutes"}:
+            changes.update(appointment_bounds({**existing_appointment, **changes}))
+        merged = {**existing_appointment, **changes}
+        
+        # Move, resize, book or free the slot before saving so conflicts reject the update
+        await apply_schedule_change(existing_appointment, merged)
+        
+        try:
+            updated_appointment = await db.appointments.find_one_and_update(
+                {"id": appointment_id, "version": existing_appointment['version']},
+                {"$set": changes, "$inc": {"version": 1}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception:
+            await resync_schedule(merged)
+            raise
+        if updated_appointment is not None:
+            await track_scheduled(existing_appointment, -1)
+            await track_scheduled(updated_appointment, 1)
+            await bump_collection_version("appointments")
+            change_feed.notify("appointments", "updated", updated_appointment, existing_appointment)
+            set_etag(response, updated_appointment)
+            return Appointment(**updated_appointment)
+        
+        # Lost a race with another write: book what it saved instead of ours
+        await resync_schedule(merged)
+        if expected_version is not None:
+            await raise_write_failure(db.appointments, appointment_id, expected_version, "Appointment")
     
-    return Appointment(**updated_appointment)
+    raise HTTPException(status_code=503, detail="Appointment is being modified concurrently, please retry", headers={"Retry-After": "1"})
 
 @api_router.delete("/appointments/{appointment_id}")
-async def delete_appointment(appointment_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.appointments.delete_one({"id": appointment_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+async def delete_appointment(
+    appointment_id: str,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    expected_version = parse_if_match(if_match)
+    deleted = await db.appointments.find_one_and_delete(versioned_filter(appointment_id, expected_version), {"_id": 0})
+    if deleted is None:
+        await raise_write_failure(db.appointments, appointment_id, expected_version, "Appointment")
+    await increment_counter(TOTALS_COUNTER_ID, "appointments", -1)
+    await track_scheduled(deleted, -1)
+    await release_interval(deleted)
+    await bump_collection_version("appointments")
+    change_feed.notify("appointments", "deleted", None, deleted)
     return {"message": "Appointment deleted successfully"}
 
-# ==================== CHATBOT ROUTES ====================
-
-@api_router.post("/chat/message", response_model=ChatResponse)
-async def chat_message(chat_data: ChatMessage, current_user: User = Depends(get_current_user)):
-    session_id = chat_data.session_id or str(uuid.uuid4())
-    
-    # Get chat history for context
-    history = await db.chat_history.find(
-        {"session_id": session_id, "user_id": current_user.id},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(5).to_list(5)
+@api_router.get("/availability", response_model=List[DoctorAvailability])
+async def get_availability(
+    doctor_name: List[str] = Query(...),
+    date_from: str = Query(...),
+    date_to: Optional[str] = None,
+    slot_minutes: int = Query(DEFAULT_APPOINTMENT_MINUTES, gt=0, le=24 * 60),
+    day_start: str = CLINIC_DAY_START,
+    day_end: str = CLINIC_DAY_END,
+    current_user: User = Depends(get_current_user)
+):
+    """Free slot start times per doctor and day, within working hours."""
+    first = datetime.strptime(validate_date(date_from), "%Y-%m-%d").date()
+    last = datetime.strptime(validate_date(date_to or date_from), "%Y-%m-%d").date()
+    if last < first or (last - first).days > 62:
+        raise HTTPException(status_code=422, detail="date_to must be within 62 days after date_from")
+    start, end = parse_minutes(day_start), parse_minutes(day_end)
     
-    # Build context from history
-    context = ""
-    if history:
-        context = "Previous conversation:\n"
-        for h in reversed(history):
-            context += f"User: {h['message']}\nAssistant: {h['response']}\n"
+    schedules = await db.doctor_schedules.find(
+        {"doctor_name": {"$in": doctor_name}, "date": {"$gte": first.isoformat(), "$lte": last.isoformat()}},
+        {"_id": 1, "intervals": 1}
+    ).to_list(None)
+    intervals_by_key = {s['_id']: s['intervals'] for s in schedules}
     
-    # System message for healthcare context
-    system_message = """You are SmartClinic AI, a helpful medical assistant chatbot. 
+    availability = []
+    for name in doctor_name:
+        for offset in range((last - first).days + 1):
+            date = (first + timedelta(days=offset)).isoformat()
+            intervals = intervals_by_key.get(schedule_id(name, date), [])
+            availability.append(DoctorAvailability(
+                doctor_name=name, date=date, slots=free_slots(intervals, start, end, slot_minutes)
+            ))
+    return availability
+
+# ==================== DASHBOARD ROUTES ====================
+
+@api_router.get("/dashboard/stats", response_model=DashboardStats)
+async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
+    return await read_dashboard_stats()
+
+@api_router.post("/dashboard/stats/rebuild", response_model=DashboardStats)
+async def rebuild_dashboard_stats(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can rebuild dashboard stats")
+    return await rebuild_dashboard_counters()
+
+# ==================== JOB ROUTES ====================
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Job(**job)
+
+@api_router.post("/jobs/orphan-sweep", response_model=Job)
+async def start_orphan_sweep(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can start an orphan sweep")
+    return Job(**await enqueue_job("orphan_sweep", {}))
+
+# ==================== DEBUG ROUTES ====================
+
+@api_router.get("/debug/profiling", response_model=ProfilingSettings)
+async def get_profiling_settings(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view profiling settings")
+    return ProfilingSettings(enabled=PROFILING_ENABLED, **profiling_state)
+
+@api_router.put("/debug/profiling", response_model=ProfilingSettings)
+async def update_profiling_settings(settings: ProfilingSettingsUpdate, current_user: User = Depends(get_current_user)):
+    """Change the sampling rate for this worker; requires PROFILING_ENABLED."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can change profiling settings")
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=409, detail="Profiling is disabled; set PROFILING_ENABLED=true")
+    profiling_state["sample_rate"] = settings.sample_rate
+    return ProfilingSettings(enabled=PROFILING_ENABLED, **profiling_state)
+
+# ==================== LLM CLIENTS ====================
+
+# System message for healthcare context
+CHAT_SYSTEM_MESSAGE = """You are SmartClinic AI, a helpful medical assistant chatbot. 
     You can help with:
     1. General health information and wellness tips
     2. Answering questions about symptoms (always recommend seeing a doctor for diagnosis)
@@ -364,36 +2685,467 @@ async def chat_message(chat_data: ChatMessage, current_user: User = Depends(get_
     
     Always be professional, empathetic, and remind users that you're not a replacement for professional medical advice.
     Never diagnose conditions or prescribe medications."""
+
+class StubLlmChat:
+    """Local stand-in for LlmChat used in tests and benchmarks; makes no network calls."""
     
-    try:
-        # Initialize LlmChat with OpenAI GPT-4o
-        chat = LlmChat(
-            api_key=os.environ['EMERGENT_LLM_KEY'],
+    def __init__(self, session_id: str, delay: float = 0.0):
+        self.session_id = session_id
+        self.delay = delay
+    
+    async def send_message(self, user_message: UserMessage) -> str:
+        return "".join([chunk async for chunk in self.stream_message(user_message)])
+    
+    async def stream_message(self, user_message: UserMessage) -> AsyncIterator[str]:
+        question = user_message.text.rsplit("Current question: ", 1)[-1]
+        for word in f"This is a stub reply to: {question}".split(" "):
+            await asyncio.sleep(self.delay)
+            yield word + " "
+
+def emergent_chat_factory(model: str):
+    provider, model_name = model.split("/", 1)
+    api_key = os.environ['EMERGENT_LLM_KEY']
+    
+    def factory(session_id: str) -> LlmChat:
+        return LlmChat(
+            api_key=api_key,
             session_id=session_id,
-            system_message=system_message
-        ).with_model("openai", "gpt-4o")
+            system_message=CHAT_SYSTEM_MESSAGE
+        ).with_model(provider, model_name)
+    return factory
+
+def stub_chat_factory(model: str):
+    delay = float(os.environ.get('LLM_STUB_DELAY_SECONDS', '0'))
+    return lambda session_id: StubLlmChat(session_id, delay=delay)
+
+LLM_PROVIDERS = {
+    "emergent": emergent_chat_factory,
+    "stub": stub_chat_factory,
+}
+
+async def stream_llm_reply(chat, user_message: UserMessage) -> AsyncIterator[str]:
+    """Yield the reply in chunks as the provider produces them.
+    
+    Providers without a `stream_message` async generator are sent the message
+    normally and their full reply is yielded as a single chunk.
+    """
+    stream_message = getattr(chat, "stream_message", None)
+    if stream_message is None:
+        yield await chat.send_message(user_message)
+        return
+    
+    async with aclosing(stream_message(user_message)) as chunks:
+        async for chunk in chunks:
+            if chunk:
+                yield chunk
+
+# Provider errors worth another attempt: throttling and server-side failures.
+# A timeout is not retried, since a hung provider would likely hang again.
+TRANSIENT_LLM_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def is_transient_llm_error(e: Exception) -> bool:
+    if isinstance(e, ConnectionError):
+        return True
+    status_code = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status_code in TRANSIENT_LLM_STATUS_CODES
+
+class LlmClient:
+    """Shared entry point to one model.
+    
+    Holds the provider configuration read once at startup, a concurrency limit,
+    per-call timeouts and retries of transient errors with jittered exponential
+    backoff, all within an overall deadline. A concurrency slot is held only
+    while an attempt runs, not through the backoff. LlmChat objects keep
+    per-conversation state, so a fresh one is built for each call from the
+    cached factory; the HTTP connection pool lives in the provider library and
+    is shared across them.
+    """
+    
+    def __init__(self, model: str, factory, max_concurrency: int, timeout: float, max_retries: int, backoff: float, deadline: float):
+        self.model = model
+        self.factory = factory
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def send(self, session_id: str, user_message: UserMessage) -> str:
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            async with self.semaphore:
+                start = time.perf_counter()
+                try:
+                    chat = self.factory(session_id)
+                    timeout = min(self.timeout, deadline - time.monotonic())
+                    reply = await asyncio.wait_for(chat.send_message(user_message), timeout)
+                    self.record(start, "send", "success", user_message.text, reply)
+                    return reply
+                except Exception as e:
+                    self.record(start, "send", "error", user_message.text)
+                    error = e
+            
+            delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if attempt == self.max_retries or not is_transient_llm_error(error) or time.monotonic() + delay >= deadline:
+                raise error
+            logger.warning(f"LLM call to {self.model} failed ({str(error) or type(error).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+    
+    async def stream(self, session_id: str, user_message: UserMessage) -> AsyncIterator[str]:
+        # Streams are not retried: chunks may already have reached the client
+        async with self.semaphore:
+            start = time.perf_counter()
+            parts = []
+            outcome = "cancelled"
+            try:
+                chat = self.factory(session_id)
+                async with aclosing(stream_llm_reply(chat, user_message)) as chunks:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(anext(chunks), self.timeout)
+                        except StopAsyncIteration:
+                            outcome = "success"
+                            return
+                        parts.append(chunk)
+                        yield chunk
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                self.record(start, "stream", outcome, user_message.text, "".join(parts))
+    
+    def record(self, start: float, mode: str, outcome: str, prompt: str, reply: str = ""):
+        end = time.perf_counter()
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add(f"llm.{mode}", start, end)
+        LLM_LATENCY.labels(self.model, mode).observe(end - start)
+        LLM_REQUESTS.labels(self.model, mode, outcome).inc()
+        LLM_TOKENS.labels(self.model, "prompt").inc(estimate_tokens(CHAT_SYSTEM_MESSAGE + prompt))
+        if reply:
+            LLM_TOKENS.labels(self.model, "completion").inc(estimate_tokens(reply))
+
+llm_clients = {}
+
+def init_llm_clients():
+    if LLM_PROVIDER not in LLM_PROVIDERS:
+        raise RuntimeError(f"Unknown LLM_PROVIDER: {LLM_PROVIDER}")
+    llm_clients[LLM_MODEL] = LlmClient(
+        LLM_MODEL,
+        LLM_PROVIDERS[LLM_PROVIDER](LLM_MODEL),
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        backoff=LLM_RETRY_BACKOFF,
+        deadline=LLM_DEADLINE
+    )
+    logger.info(f"LLM client ready: {LLM_PROVIDER} {LLM_MODEL}")
+
+def get_llm_client(model: str = LLM_MODEL) -> LlmClient:
+    return llm_clients[model]
+
+# ==================== CHATBOT HELPERS ====================
+
+async def build_user_message(session_id: str, user_id: str, message: str) -> tuple:
+    """Prefix the question with the session's rolling summary.
+    
+    Returns (user_message, has_context).
+    """
+    session = await db.chat_sessions.find_one(
+        {"session_id": session_id, "user_id": user_id},
+        {"_id": 0, "lines": 1}
+    )
+    lines = session.get('lines', []) if session else []
+    
+    # Turns still waiting in the write-behind queue are not in the summary yet
+    pending = chat_history_writer.pending_for(session_id, user_id)
+    if pending:
+        lines = fit_to_budget(lines + [summarize_turn(turn['message'], turn['response']) for turn in pending])
+    
+    user_message_text = message
+    if lines:
+        context = "Previous conversation:\n" + "\n".join(lines)
+        user_message_text = f"{context}\n\nCurrent question: {message}"
+    
+    return UserMessage(text=user_message_text), bool(lines)
+
+def save_chat_turn(session_id: str, user_id: str, message: str, response_text: str):
+    """Queue the turn for chat_history and the session summary; see ChatHistoryWriter."""
+    chat_history = ChatHistory(
+        session_id=session_id,
+        user_id=user_id,
+        message=message,
+        response=response_text
+    )
+    
+    chat_history_writer.add(chat_history.model_dump())
+
+# ==================== CHAT SUMMARIES ====================
+
+# Instead of replaying raw history, each session keeps a rolling summary in
+# db.chat_sessions: one compact line per turn (the question plus an excerpt
+# of the reply), trimmed from the oldest end to CHAT_CONTEXT_TOKEN_BUDGET.
+# When a turn pushes the summary over budget, older lines are condensed by the
+# LLM in the background so earlier context is compressed rather than lost.
+background_tasks = set()
+
+def estimate_tokens(text: str) -> int:
+    # Rough average for English text; avoids loading a tokenizer per request
+    return len(text) // 4 + 1
+
+def summary_excerpt(text: str) -> str:
+    excerpt = " ".join(text.split())
+    if len(excerpt) > CHAT_SUMMARY_EXCERPT_CHARS:
+        excerpt = excerpt[:CHAT_SUMMARY_EXCERPT_CHARS].rsplit(" ", 1)[0] + "..."
+    return excerpt
+
+def summarize_turn(message: str, response_text: str) -> str:
+    # Both sides are cut, since fit_to_budget always keeps the newest line
+    return f"User: {summary_excerpt(message)}\nAssistant: {summary_excerpt(response_text)}"
+
+def fit_to_budget(lines: List[str]) -> List[str]:
+    kept = []
+    used = 0
+    for line in reversed(lines):
+        used += estimate_tokens(line)
+        if used > CHAT_CONTEXT_TOKEN_BUDGET and kept:
+            break
+        kept.append(line)
+    return list(reversed(kept))
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def update_session_summary(session_id: str, user_id: str, new_turns: List[dict]):
+    """Append chat_history turns (oldest first) to the session's rolling summary."""
+    session_filter = {"session_id": session_id, "user_id": user_id}
+    session = await db.chat_sessions.find_one(session_filter, {"_id": 0}) or {}
+    lines = session.get('lines', []) + [summarize_turn(turn['message'], turn['response']) for turn in new_turns]
+    turns = session.get('turns', 0) + len(new_turns)
+    
+    kept = fit_to_budget(lines)
+    await db.chat_sessions.update_one(
+        session_filter,
+        {"$set": {"lines": kept, "turns": turns, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    
+    if CHAT_SUMMARY_CONDENSE and len(kept) < len(lines) and len(lines) > 2:
+        spawn_background(condense_session_summary(session_filter, lines, turns))
+
+async def condense_session_summary(session_filter: dict, lines: List[str], turns: int):
+    """Replace all but the latest two turns with one LLM-written summary line."""
+    older, recent = lines[:-2], lines[-2:]
+    prompt = (
+        "Summarize this conversation between a user and a medical assistant in at most "
+        f"{CHAT_CONTEXT_TOKEN_BUDGET * 3 // 8} words. Keep symptoms, conditions and "
+        "questions the user mentioned.\n\n" + "\n".join(older)
+    )
+    try:
+        summary = await get_llm_client().send(f"summary-{session_filter['session_id']}", UserMessage(text=prompt))
+    except Exception as e:
+        logger.warning(f"Chat summary condensation failed: {str(e)}")
+        return
+    
+    condensed = fit_to_budget([f"Summary of earlier conversation: {' '.join(summary.split())}"] + recent)
+    # Skip if another turn landed meanwhile; the next turn will condense again
+    await db.chat_sessions.update_one(
+        {**session_filter, "turns": turns},
+        {"$set": {"lines": condensed, "updated_at": datetime.now(timezone.utc)}}
+    )
+
+# ==================== CHAT HISTORY WRITER ====================
+
+# Chat turns are persisted behind the reply: save_chat_turn() only queues the
+# turn, and a background task writes queued turns with one insert_many per
+# batch, then folds them into each session's summary. A flush happens once
+# CHAT_HISTORY_BATCH_SIZE turns are queued, every CHAT_HISTORY_FLUSH_SECONDS,
+# and on shutdown. Until a turn is written it stays in `pending`, which
+# build_user_message() and the history route read, so the next message sees
+# it. The queue is per process: with several workers a follow-up routed to a
+# different worker within the flush interval misses the newest turn.
+class ChatHistoryWriter:
+    def __init__(self, batch_size: int, interval: float, max_pending: int):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.stopping = False
+    
+    def add(self, doc: dict):
+        self.pending.append(doc)
+        if len(self.pending) > self.max_pending:
+            dropped = self.pending.pop(0)
+            logger.error(f"Chat history queue full, dropped turn {dropped['id']}")
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+    
+    def pending_for(self, session_id: str, user_id: str) -> List[dict]:
+        return [
+            doc for doc in self.pending
+            if doc['session_id'] == session_id and doc['user_id'] == user_id
+        ]
+    
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+    
+    async def flush(self):
+        async with self.lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                if not await self.write_batch(batch):
+                    # Left queued; the next flush retries it
+                    return
+                written = {doc['id'] for doc in batch}
+                self.pending = [doc for doc in self.pending if doc['id'] not in written]
+    
+    async def write_batch(self, batch: List[dict]) -> bool:
+        try:
+            # Copies, since insert_many adds _id to the documents it is given
+            await db.chat_history.insert_many([dict(doc) for doc in batch], ordered=False)
+        except BulkWriteError as e:
+            # Duplicate ids are turns already written by an earlier, partly failed attempt
+            errors = [error for error in e.details['writeErrors'] if error['code'] != 11000]
+            if errors:
+                logger.error(f"Chat history write failed: {errors[0]['errmsg']}")
+                return False
+        except Exception as e:
+            logger.error(f"Chat history write failed: {str(e)}")
+            return False
         
-        # Create user message with context
-        user_message_text = chat_data.message
-        if context:
-            user_message_text = f"{context}\n\nCurrent question: {chat_data.message}"
+        sessions = {}
+        for doc in batch:
+            sessions.setdefault((doc['session_id'], doc['user_id']), []).append(doc)
+        for (session_id, user_id), turns in sessions.items():
+            try:
+                await update_session_summary(session_id, user_id, turns)
+            except Exception as e:
+                logger.warning(f"Chat summary update failed for {session_id}: {str(e)}")
+        return True
+    
+    def start(self):
+        self.stopping = False
+        self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        if self.task is not None:
+            # Let the loop finish its current flush and exit; cancelling it
+            # mid-batch would have the final flush re-apply summary lines
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        await self.flush()
+        if self.pending:
+            logger.error(f"Discarding {len(self.pending)} unwritten chat turns at shutdown")
+
+chat_history_writer = ChatHistoryWriter(CHAT_HISTORY_BATCH_SIZE, CHAT_HISTORY_FLUSH_SECONDS, CHAT_HISTORY_MAX_PENDING)
+
+# ==================== CHAT RESPONSE CACHE ====================
+
+# Replies to context-free first questions are cached in db.chat_cache (expired
+# by a TTL index). A question is reduced to its words in order, dropping only
+# filler words; negations and relations such as "with" or "not" are kept. An
+# exact match is an indexed key lookup and is served to any user: the asker
+# typed the whole question, so the reply reveals nothing new. Otherwise up to
+# CHAT_CACHE_CANDIDATES of the asker's own entries sharing a word are scored
+# by Jaccard similarity over consecutive word pairs, so "X with Y" does not
+# match "Y with X", and the best one at or above CHAT_CACHE_SIMILARITY is used.
+# Near matches stay per user, since a reply can echo details of the question
+# that differ from what this user asked.
+CHAT_CACHE_STOPWORDS = frozenset("a an the please tell me".split())
+CHAT_CACHE_HITS = Counter("chat_cache_hits", "Chat response cache hits")
+CHAT_CACHE_MISSES = Counter("chat_cache_misses", "Chat response cache misses")
+
+def question_terms(message: str) -> List[str]:
+    words = re.findall(r"[a-z0-9]+", message.lower())
+    return [w for w in words if w not in CHAT_CACHE_STOPWORDS]
+
+def question_pairs(terms: List[str]) -> set:
+    padded = ["", *terms]
+    return set(zip(padded, padded[1:]))
+
+def question_key(terms: List[str]) -> str:
+    return hashlib.sha256(" ".join(terms).encode()).hexdigest()
+
+async def lookup_cached_response(user_id: str, message: str) -> Optional[str]:
+    if not CHAT_CACHE_ENABLED:
+        return None
+    terms = question_terms(message)
+    if not terms:
+        return None
+    
+    entry = await db.chat_cache.find_one({"key": question_key(terms)}, {"_id": 0, "response": 1})
+    if entry is None:
+        candidates = await db.chat_cache.find(
+            {"user_id": user_id, "terms": {"$in": terms}}, {"_id": 0, "terms": 1, "response": 1}
+        ).limit(CHAT_CACHE_CANDIDATES).to_list(CHAT_CACHE_CANDIDATES)
         
-        user_message = UserMessage(text=user_message_text)
+        best_score = 0.0
+        pairs = question_pairs(terms)
+        for candidate in candidates:
+            candidate_pairs = question_pairs(candidate['terms'])
+            score = len(pairs & candidate_pairs) / len(pairs | candidate_pairs)
+            if score >= CHAT_CACHE_SIMILARITY and score > best_score:
+                entry, best_score = candidate, score
+    
+    if entry is None:
+        CHAT_CACHE_MISSES.inc()
+        return None
+    CHAT_CACHE_HITS.inc()
+    return entry['response']
+
+async def store_cached_response(user_id: str, message: str, response_text: str):
+    if not CHAT_CACHE_ENABLED:
+        return
+    terms = question_terms(message)
+    if not terms:
+        return
+    await db.chat_cache.update_one(
+        {"key": question_key(terms)},
+        {"$setOnInsert": {
+            "user_id": user_id,
+            "terms": terms,
+            "message": message,
+            "response": response_text,
+            "created_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# ==================== CHATBOT ROUTES ====================
+
+@api_router.post("/chat/message", response_model=ChatResponse)
+async def chat_message(chat_data: ChatMessage, current_user: User = Depends(rate_limit_by_user("chat"))):
+    session_id = chat_data.session_id or str(uuid.uuid4())
+    user_message, has_context = await build_user_message(session_id, current_user.id, chat_data.message)
+    
+    try:
+        # Context-free questions may be answered from the response cache
+        response_text = None if has_context else await lookup_cached_response(current_user.id, chat_data.message)
         
-        # Get response from AI
-        response_text = await chat.send_message(user_message)
+        if response_text is None:
+            # Get response from AI
+            response_text = await get_llm_client().send(session_id, user_message)
+            if not has_context:
+                await store_cached_response(current_user.id, chat_data.message, response_text)
         
         # Store in chat history
-        chat_history = ChatHistory(
-            session_id=session_id,
-            user_id=current_user.id,
-            message=chat_data.message,
-            response=response_text
-        )
-        
-        history_doc = chat_history.model_dump()
-        history_doc['timestamp'] = history_doc['timestamp'].isoformat()
-        await db.chat_history.insert_one(history_doc)
+        save_chat_turn(session_id, current_user.id, chat_data.message, response_text)
         
         return ChatResponse(response=response_text, session_id=session_id)
         
@@ -401,6 +3153,51 @@ async def chat_message(chat_data: ChatMessage, current_user: User = Depends(get_
         logging.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat service error: {str(e)}")
 
+@api_router.post("/chat/stream")
+async def chat_stream(chat_data: ChatMessage, request: Request, current_user: User = Depends(rate_limit_by_user("chat"))):
+    """Stream the reply as Server-Sent Events.
+    
+    Emits a `session` event, one `token` event per chunk, then `done` once the
+    assembled reply has been queued for saving (or `error`). If the client
+    disconnects the upstream LLM stream is closed and nothing is saved.
+    """
+    session_id = chat_data.session_id or str(uuid.uuid4())
+    user_message, has_context = await build_user_message(session_id, current_user.id, chat_data.message)
+    
+    async def event_stream():
+        yield sse_event("session", {"session_id": session_id})
+        
+        parts = []
+        try:
+            cached = None if has_context else await lookup_cached_response(current_user.id, chat_data.message)
+            if cached is not None:
+                parts.append(cached)
+                yield sse_event("token", {"text": cached})
+            else:
+                async with aclosing(get_llm_client().stream(session_id, user_message)) as chunks:
+                    async for chunk in chunks:
+                        if await request.is_disconnected():
+                            logger.info(f"Chat stream {session_id} cancelled by client")
+                            return
+                        parts.append(chunk)
+                        yield sse_event("token", {"text": chunk})
+                if not has_context:
+                    await store_cached_response(current_user.id, chat_data.message, "".join(parts))
+            
+            save_chat_turn(session_id, current_user.id, chat_data.message, "".join(parts))
+        except Exception as e:
+            logging.error(f"Chat error: {str(e)}")
+            yield sse_event("error", {"detail": f"Chat service error: {str(e)}"})
+            return
+        
+        yield sse_event("done", {"session_id": session_id})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/chat/history/{session_id}")
 async def get_chat_history(session_id: str, current_user: User = Depends(get_current_user)):
     history = await db.chat_history.find(
@@ -408,25 +3205,88 @@ async def get_chat_history(session_id: str, current_user: User = Depends(get_cur
         {"_id": 0}
     ).sort("timestamp", 1).to_list(100)
     
-    for h in history:
-        if isinstance(h.get('timestamp'), str):
-            h['timestamp'] = datetime.fromisoformat(h['timestamp'])
+    # Include turns not yet flushed by the write-behind queue
+    stored = {doc['id'] for doc in history}
+    history += [doc for doc in chat_history_writer.pending_for(session_id, current_user.id) if doc['id'] not in stored]
+    return history[:100]
+
+# ==================== CHANGE EVENTS ====================
+
+@api_router.websocket("/ws/changes")
+async def change_events(
+    websocket: WebSocket,
+    collections: str = "appointments,patients",
+    doctor_name: Optional[str] = None,
+    date: Optional[str] = None,
+    resume_after: Optional[str] = None
+):
+    """Push appointment/patient changes as JSON messages.
+    
+    Browsers cannot set headers on a WebSocket, and a query parameter would
+    put the token in access logs, so the client's first message must be
+    `{"type": "auth", "token": "<access token>"}`, sent within
+    CHANGE_FEED_AUTH_TIMEOUT seconds. Each `change` message carries an `id`;
+    pass the last one seen as `resume_after` when reconnecting to receive what
+    was missed.
+    """
+    await websocket.accept()
+    try:
+        message = json.loads(await asyncio.wait_for(websocket.receive_text(), CHANGE_FEED_AUTH_TIMEOUT))
+        if not isinstance(message, dict) or message.get("type") != "auth":
+            raise ValueError("expected an auth message")
+        await resolve_user(str(message.get("token", "")))
+    except WebSocketDisconnect:
+        return
+    except (asyncio.TimeoutError, ValueError, HTTPException):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
     
-    return history
+    subscription = ChangeSubscription(set(collections.split(",")) & CHANGE_FEED_COLLECTIONS.keys(), doctor_name, date)
+    if not change_feed.subscribe(subscription, resume_after):
+        subscription.push(RESET_MESSAGE)
+    
+    async def forward():
+        while True:
+            await websocket.send_text(await subscription.queue.get())
+    
+    sender = asyncio.create_task(forward())
+    try:
+        while True:
+            # Clients send nothing after auth; this only notices the disconnect
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        change_feed.unsubscribe(subscription)
 
 @api_router.get("/")
 async def root():
     return {"message": "SmartClinic AI API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Include router
 app.include_router(api_router)
 
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Retry-After"],
 )
 
 logging.basicConfig(
@@ -435,6 +3295,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    await run_migrations()
+    await ensure_indexes()
+    await backfill_patient_search_grams()
+    await ensure_doctor_schedules()
+    init_llm_clients()
+    chat_history_writer.start()
+    await change_feed.start()
+    await resume_jobs()
+    if ORPHAN_SWEEP_INTERVAL > 0:
+        sweeper = asyncio.create_task(schedule_orphan_sweeps())
+        sweeper_tasks.add(sweeper)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await chat_history_writer.stop()
+    await change_feed.stop()
+    for sweeper in sweeper_tasks:
+        sweeper.cancel()
+    client.close()
+    password_executor.shutdown(wait=False)
\ No newline at end of file
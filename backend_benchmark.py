@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""Concurrent load test and latency benchmark for the SmartClinic AI backend.
+
+By default the backend is started in-process on a local port with an
+in-memory MongoDB stand-in (mongomock-motor) and the stub LLM provider, so
+runs are self-contained and repeatable. Pass --base-url to drive an already
+running server instead.
+
+    python backend_benchmark.py --users 50 --duration 30 --output bench.json
+    python backend_benchmark.py --baseline bench.json
+    python backend_benchmark.py --serialization 1000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent
+
+# Relative weights of each action in a virtual user's loop
+DEFAULT_MIX = {
+    "login": 1,
+    "list_patients": 6,
+    "get_patient": 3,
+    "list_appointments": 4,
+    "create_appointment": 2,
+    "dashboard_stats": 3,
+    "chat": 1,
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class SmartClinicBenchmark:
+    def __init__(self, base_url, users, duration, mix, seed_patients):
+        self.base_url = base_url
+        self.api_url = f"{base_url}/api"
+        self.users = users
+        self.duration = duration
+        self.mix = mix
+        self.seed_patients = seed_patients
+        self.latencies = {name: [] for name in mix}
+        self.errors = {name: 0 for name in mix}
+        self.patient_ids = []
+
+    async def timed(self, name, client, method, endpoint, expected=(), **kwargs):
+        """Send one request, recording its latency under `name`.
+
+        Status codes listed in `expected` (e.g. 409 for a booking conflict)
+        are not counted as errors.
+        """
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, f"{self.api_url}/{endpoint}", **kwargs)
+            ok = response.status_code < 400 or response.status_code in expected
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        if not ok:
+            self.errors[name] += 1
+        return response
+
+    async def setup(self, client):
+        """Register the virtual users and seed patients to read back."""
+        accounts = []
+        for i in range(self.users):
+            account = {
+                "email": f"bench_{uuid.uuid4().hex[:12]}@smartclinic.com",
+                "password": "BenchPass123!",
+                "full_name": f"Bench Doctor {i}",
+                "role": "doctor",
+            }
+            response = await client.post(f"{self.api_url}/auth/register", json=account)
+            response.raise_for_status()
+            account["token"] = response.json()["access_token"]
+            accounts.append(account)
+
+        headers = {"Authorization": f"Bearer {accounts[0]['token']}"}
+        for i in range(self.seed_patients):
+            response = await client.post(f"{self.api_url}/patients", headers=headers, json={
+                "first_name": f"Bench{i}",
+                "last_name": random.choice(["Smith", "Patel", "Garcia", "Chen", "Okafor"]),
+                "email": f"patient_{uuid.uuid4().hex[:12]}@example.com",
+                "phone": "+1-555-0100",
+                "date_of_birth": "1985-06-15",
+                "gender": random.choice(["male", "female"]),
+                "address": "1 Benchmark Way",
+                "medical_history": "None",
+            })
+            response.raise_for_status()
+            self.patient_ids.append(response.json()["id"])
+        return accounts
+
+    async def virtual_user(self, client, account, deadline):
+        headers = {"Authorization": f"Bearer {account['token']}"}
+        actions = list(self.mix)
+        weights = [self.mix[a] for a in actions]
+        session_id = None
+
+        while time.perf_counter() < deadline:
+            action = random.choices(actions, weights)[0]
+            if action == "login":
+                await self.timed(action, client, "POST", "auth/login", json={
+                    "email": account["email"], "password": account["password"]
+                })
+            elif action == "list_patients":
+                await self.timed(action, client, "GET", "patients", headers=headers, params={"limit": 50})
+            elif action == "get_patient":
+                await self.timed(action, client, "GET", f"patients/{random.choice(self.patient_ids)}", headers=headers)
+            elif action == "list_appointments":
+                await self.timed(action, client, "GET", "appointments", headers=headers, params={"limit": 50})
+            elif action == "create_appointment":
+                day = datetime.now(timezone.utc).date() + timedelta(days=random.randint(0, 30))
+                await self.timed(action, client, "POST", "appointments", headers=headers, expected=(409,), json={
+                    "patient_id": random.choice(self.patient_ids),
+                    "patient_name": "Bench Patient",
+                    "doctor_name": account["full_name"],
+                    "appointment_date": day.isoformat(),
+                    "appointment_time": f"{random.randint(8, 17):02d}:{random.choice(['00', '30'])}",
+                    "reason": "Benchmark visit",
+                })
+            elif action == "dashboard_stats":
+                await self.timed(action, client, "GET", "dashboard/stats", headers=headers)
+            elif action == "chat":
+                response = await self.timed(action, client, "POST", "chat/message", headers=headers, json={
+                    "message": random.choice([
+                        "What are the symptoms of a common cold?",
+                        "How much water should I drink per day?",
+                        "What does a blood pressure reading mean?",
+                    ]),
+                    "session_id": session_id,
+                })
+                if response is not None and response.status_code == 200:
+                    session_id = response.json()["session_id"]
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.users, max_keepalive_connections=self.users)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            print(f"🔧 Registering {self.users} users and seeding {self.seed_patients} patients...")
+            accounts = await self.setup(client)
+
+            print(f"🚀 Running {self.users} concurrent users for {self.duration}s against {self.base_url}")
+            started = time.perf_counter()
+            deadline = started + self.duration
+            await asyncio.gather(*(self.virtual_user(client, a, deadline) for a in accounts))
+            elapsed = time.perf_counter() - started
+
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        endpoints = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(values[-1], 2) if values else 0.0,
+            }
+        all_values = sorted(v for values in self.latencies.values() for v in values)
+        return {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                "base_url": self.base_url,
+                "users": self.users,
+                "duration_s": self.duration,
+                "seed_patients": self.seed_patients,
+                "mix": self.mix,
+            },
+            "total": {
+                "requests": len(all_values),
+                "errors": sum(self.errors.values()),
+                "throughput_rps": round(len(all_values) / elapsed, 2),
+                "p50_ms": round(percentile(all_values, 50), 2),
+                "p95_ms": round(percentile(all_values, 95), 2),
+                "p99_ms": round(percentile(all_values, 99), 2),
+            },
+            "endpoints": endpoints,
+        }
+
+
+def print_report(results, baseline=None):
+    print("\n" + "=" * 78)
+    print("📊 BENCHMARK RESULTS")
+    print("=" * 78)
+    print(f"{'endpoint':<20}{'reqs':>8}{'errs':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(results["endpoints"].items()) + [("TOTAL", results["total"])]
+    for name, stats in rows:
+        print(f"{name:<20}{stats['requests']:>8}{stats['errors']:>6}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+        if baseline:
+            before = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+            if before and before["p95_ms"]:
+                change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+                print(f"{'':<20}p95 {before['p95_ms']} -> {stats['p95_ms']} ms ({change:+.1f}%)")
+
+
+def import_server():
+    """Import the backend against in-memory Mongo and the stub LLM."""
+    import mongomock_motor
+    import motor.motor_asyncio
+
+    os.environ.setdefault("LLM_PROVIDER", "stub")
+    # Simulated users would otherwise exhaust the per-user chat and auth buckets
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("CHANGE_FEED_SOURCE", "local")
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    sys.path.insert(0, str(ROOT_DIR / "backend"))
+    import server
+    return server
+
+
+def serialization_benchmark(records, rounds=20):
+    """Time list-response serialization per 1000 records: validated vs fast path."""
+    from pydantic import TypeAdapter
+    from typing import List
+
+    server = import_server()
+    now = datetime.now(timezone.utc)
+    docs = [
+        server.Patient(
+            first_name=f"Bench{i}",
+            last_name="Patel",
+            email=f"patient{i}@example.com",
+            phone="+1-555-0100",
+            date_of_birth="1985-06-15",
+            gender="female",
+            address="1 Benchmark Way",
+            medical_history="Seasonal allergies; no known drug allergies. " * 4,
+            created_at=now,
+            updated_at=now,
+        ).model_dump()
+        for i in range(records)
+    ]
+    adapter = TypeAdapter(List[server.Patient])
+
+    def validated():
+        # What FastAPI does for response_model=List[Patient], then JSONResponse
+        content = adapter.dump_python(adapter.validate_python(docs), mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+    def fast():
+        return server.FastJSONResponse(docs).body
+
+    assert json.loads(validated()) == json.loads(fast())
+    results = {}
+    for name, func in (("validated", validated), ("fast", fast)):
+        func()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        per_call = (time.perf_counter() - start) / rounds
+        results[name] = round(per_call / records * 1000 * 1000, 3)
+
+    print(f"\n📊 Serialization cost per 1000 patients ({records} records x {rounds} rounds)")
+    print(f"  validated (response_model): {results['validated']} ms")
+    print(f"  fast (orjson):              {results['fast']} ms")
+    print(f"  speedup:                    {results['validated'] / results['fast']:.1f}x")
+    return {"records": records, "rounds": rounds, "ms_per_1000": results}
+
+
+async def serve_locally(port):
+    """Start the backend in-process with in-memory Mongo and the stub LLM."""
+    import uvicorn
+
+    server = import_server()
+
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    uvicorn_server = uvicorn.Server(config)
+    task = asyncio.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return uvicorn_server, task
+
+
+async def run_benchmark(args, mix):
+    uvicorn_server = task = None
+    base_url = args.base_url
+    if not base_url:
+        uvicorn_server, task = await serve_locally(args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        benchmark = SmartClinicBenchmark(base_url, args.users, args.duration, mix, args.seed_patients)
+        return await benchmark.run()
+    finally:
+        if uvicorn_server:
+            uvicorn_server.should_exit = True
+            await task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", help="benchmark a running server instead of starting one in-process")
+    parser.add_argument("--port", type=int, default=8765, help="port for the in-process server")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=15, help="seconds to run the load phase")
+    parser.add_argument("--seed-patients", type=int, default=200, help="patients created before the run")
+    parser.add_argument("--mix", help='JSON object overriding action weights, e.g. \'{"chat": 0}\'')
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="previous JSON results to compare p95 latency against")
+    parser.add_argument("--serialization", type=int, metavar="RECORDS",
+                        help="only run the list serialization microbenchmark with this many records")
+    args = parser.parse_args()
+
+    if args.serialization:
+        results = serialization_benchmark(args.serialization)
+        if args.output:
+            Path(args.output).write_text(json.dumps(results, indent=2))
+        return 0
+
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix.update(json.loads(args.mix))
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+
+    results = asyncio.run(run_benchmark(args, mix))
+
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    print_report(results, baseline)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"\n💾 Results written to {args.output}")
+
+    return 0 if results["total"]["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import { useEffect, useRef } from 'react';
+import { API } from '@/App';
+
+// False when the message doesn't identify the record (e.g. a delete without
+// the deleted document), so the list has to be reloaded instead.
+export const canApplyChange = ({ operation, document, document_id }) =>
+  operation === 'deleted' ? Boolean(document_id) : Boolean(document);
+
+// Apply a change message to a list ordered like the API's (oldest first).
+export const applyChange = (items, { operation, document, document_id }) => {
+  if (operation === 'deleted') {
+    return items.filter((item) => item.id !== document_id);
+  }
+  if (items.some((item) => item.id === document.id)) {
+    return items.map((item) => (item.id === document.id ? document : item));
+  }
+  return operation === 'created' ? [...items, document] : items;
+};
+
+// Subscribe to /ws/changes. The access token is sent as the first message
+// rather than in the URL, which would put it in access logs. Reconnects with
+// the last event id so missed changes are replayed; onReset is called when the
+// server can't replay and the caller should reload instead.
+export const useChangeFeed = ({ collections, onChange, onReset }) => {
+  const handlers = useRef({ onChange, onReset });
+  handlers.current = { onChange, onReset };
+  const collectionsKey = collections.join(',');
+
+  useEffect(() => {
+    let socket;
+    let retryTimer;
+    let lastId = null;
+    let attempt = 0;
+    let closed = false;
+
+    const connect = () => {
+      const url = new URL(`${API}/ws/changes`, window.location.href);
+      url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+      url.searchParams.set('collections', collectionsKey);
+      if (lastId) url.searchParams.set('resume_after', lastId);
+
+      socket = new WebSocket(url);
+      socket.onopen = () => {
+        attempt = 0;
+        socket.send(JSON.stringify({ type: 'auth', token: localStorage.getItem('token') || '' }));
+      };
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'reset') {
+          handlers.current.onReset?.();
+          return;
+        }
+        lastId = message.id;
+        handlers.current.onChange?.(message);
+      };
+      socket.onclose = () => {
+        if (closed) return;
+        // Exponential backoff, capped at 30s
+        retryTimer = setTimeout(connect, Math.min(30000, 1000 * 2 ** attempt));
+        attempt += 1;
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      socket?.close();
+    };
+  }, [collectionsKey]);
+};
@@ -0,0 +1,24 @@
+import axios from 'axios';
+
+// List routes return the cursor for the following page in X-Next-Cursor;
+// it is absent on the last page.
+export const nextCursor = (response) => response.headers['x-next-cursor'] || null;
+
+// Append a page, skipping items already shown (e.g. created locally or
+// delivered by the change feed before their page was loaded).
+export const appendPage = (items, page) => {
+  const seen = new Set(items.map((item) => item.id));
+  return [...items, ...page.filter((item) => !seen.has(item.id))];
+};
+
+// Follow the cursor to the end, for lists that must be complete (pickers).
+export const fetchAllPages = async (url, params = {}) => {
+  let items = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(url, { params: { ...params, ...(cursor && { cursor }) } });
+    items = appendPage(items, response.data);
+    cursor = nextCursor(response);
+  } while (cursor);
+  return items;
+};
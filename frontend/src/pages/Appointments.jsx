@@ -9,12 +9,16 @@ import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import { toast } from 'sonner';
+import { applyChange, canApplyChange, useChangeFeed } from '@/hooks/use-change-feed';
+import { appendPage, fetchAllPages, nextCursor } from '@/lib/pagination';
 import { Plus, Edit, Trash2, Calendar } from 'lucide-react';
 
 const Appointments = () => {
   const [appointments, setAppointments] = useState([]);
   const [patients, setPatients] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [cursor, setCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [dialogOpen, setDialogOpen] = useState(false);
   const [editingAppointment, setEditingAppointment] = useState(null);
   const [formData, setFormData] = useState({
@@ -31,14 +35,30 @@ const Appointments = () => {
     fetchData();
   }, []);
 
+  // Changes made by anyone (including this screen) arrive over the change feed
+  useChangeFeed({
+    collections: ['appointments', 'patients'],
+    onChange: (message) => {
+      if (!canApplyChange(message)) {
+        fetchData();
+        return;
+      }
+      const setItems = message.collection === 'appointments' ? setAppointments : setPatients;
+      setItems((items) => applyChange(items, message));
+    },
+    onReset: () => fetchData(),
+  });
+
   const fetchData = async () => {
     try {
-      const [appointmentsRes, patientsRes] = await Promise.all([
+      // Every patient must be selectable, so the picker follows all pages
+      const [appointmentsRes, allPatients] = await Promise.all([
         axios.get(`${API}/appointments`),
-        axios.get(`${API}/patients`),
+        fetchAllPages(`${API}/patients`, { limit: 1000, fields: 'first_name,last_name' }),
       ]);
       setAppointments(appointmentsRes.data);
-      setPatients(patientsRes.data);
+      setCursor(nextCursor(appointmentsRes));
+      setPatients(allPatients);
     } catch (error) {
       toast.error('Failed to fetch data');
     } finally {
@@ -46,17 +66,34 @@ const Appointments = () => {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/appointments`, { params: { cursor } });
+      setAppointments((items) => appendPage(items, response.data));
+      setCursor(nextCursor(response));
+    } catch (error) {
+      toast.error('Failed to fetch data');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
       if (editingAppointment) {
-        await axios.put(`${API}/appointments/${editingAppointment.id}`, formData);
+        // If-Match rejects the save if someone else changed the record meanwhile
+        const response = await axios.put(`${API}/appointments/${editingAppointment.id}`, formData, {
+          headers: { 'If-Match': `"${editingAppointment.version}"` },
+        });
+        setAppointments((items) => applyChange(items, { operation: 'updated', document: response.data }));
         toast.success('Appointment updated successfully');
       } else {
-        await axios.post(`${API}/appointments`, formData);
+        const response = await axios.post(`${API}/appointments`, formData);
+        setAppointments((items) => applyChange(items, { operation: 'created', document: response.data }));
         toast.success('Appointment created successfully');
       }
-      fetchData();
       setDialogOpen(false);
       resetForm();
     } catch (error) {
@@ -68,8 +105,8 @@ const Appointments = () => {
     if (!window.confirm('Are you sure you want to delete this appointment?')) return;
     try {
       await axios.delete(`${API}/appointments/${id}`);
+      setAppointments((items) => applyChange(items, { operation: 'deleted', document_id: id }));
       toast.success('Appointment deleted successfully');
-      fetchData();
     } catch (error) {
       toast.error('Failed to delete appointment');
     }
@@ -91,9 +128,9 @@ const Appointments = () => {
 
   const handleStatusUpdate = async (id, status) => {
     try {
-      await axios.put(`${API}/appointments/${id}`, { status });
+      const response = await axios.put(`${API}/appointments/${id}`, { status });
+      setAppointments((items) => applyChange(items, { operation: 'updated', document: response.data }));
       toast.success('Appointment status updated');
-      fetchData();
     } catch (error) {
       toast.error('Failed to update status');
     }
@@ -311,6 +348,18 @@ const Appointments = () => {
                     </div>
                   </div>
                 ))}
+                {cursor && (
+                  <div className="flex justify-center">
+                    <Button
+                      variant="outline"
+                      onClick={loadMore}
+                      disabled={loadingMore}
+                      data-testid="load-more-appointments"
+                    >
+                      {loadingMore ? 'Loading...' : 'Load more'}
+                    </Button>
+                  </div>
+                )}
               </div>
             )}
           </CardContent>
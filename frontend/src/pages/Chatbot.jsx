@@ -43,16 +43,41 @@ const Chatbot = () => {
     setLoading(true);
 
     try {
-      const response = await axios.post(`${API}/chat/message`, {
-        message: userMessage,
-        session_id: sessionId,
+      // Stream the reply over SSE so tokens render as they arrive
+      const response = await fetch(`${API}/chat/stream`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          Authorization: axios.defaults.headers.common['Authorization'],
+        },
+        body: JSON.stringify({ message: userMessage, session_id: sessionId }),
       });
+      if (!response.ok) throw new Error(`Chat request failed: ${response.status}`);
 
-      setSessionId(response.data.session_id);
-      setMessages((prev) => [
-        ...prev,
-        { role: 'assistant', content: response.data.response },
-      ]);
+      setMessages((prev) => [...prev, { role: 'assistant', content: '' }]);
+      const appendToReply = (text) =>
+        setMessages((prev) => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+        });
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+          if (event === 'session') setSessionId(data.session_id);
+          else if (event === 'token') appendToReply(data.text);
+          else if (event === 'error') throw new Error(data.detail);
+        }
+      }
     } catch (error) {
       toast.error('Failed to get response from AI');
       setMessages((prev) => [
@@ -1,9 +1,10 @@
-import { useState, useEffect, useContext } from 'react';
+import { useState, useEffect, useContext, useRef } from 'react';
 import { AuthContext, API } from '@/App';
 import axios from 'axios';
 import Layout from '@/components/Layout';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Users, Calendar, MessageSquare, Activity } from 'lucide-react';
+import { applyChange, canApplyChange, useChangeFeed } from '@/hooks/use-change-feed';
 
 const Dashboard = () => {
   const { user } = useContext(AuthContext);
@@ -14,30 +15,57 @@ const Dashboard = () => {
   });
   const [recentAppointments, setRecentAppointments] = useState([]);
   const [loading, setLoading] = useState(true);
+  const statsTimer = useRef(null);
 
   useEffect(() => {
     fetchDashboardData();
+    return () => clearTimeout(statsTimer.current);
   }, []);
 
+  useChangeFeed({
+    collections: ['appointments', 'patients'],
+    onChange: (message) => {
+      if (message.collection === 'appointments') {
+        if (!canApplyChange(message)) {
+          fetchDashboardData();
+          return;
+        }
+        setRecentAppointments((items) => applyChange(items, message).slice(0, 5));
+      }
+      // Counters are a single cheap read; coalesce bursts of changes into one
+      clearTimeout(statsTimer.current);
+      statsTimer.current = setTimeout(fetchStats, 1000);
+    },
+    onReset: () => fetchDashboardData(),
+  });
+
+  const fetchStats = async () => {
+    try {
+      const statsRes = await axios.get(`${API}/dashboard/stats`);
+      setStats({
+        totalPatients: statsRes.data.total_patients,
+        totalAppointments: statsRes.data.total_appointments,
+        todayAppointments: statsRes.data.today_appointments,
+      });
+    } catch (error) {
+      console.error('Failed to fetch dashboard stats:', error);
+    }
+  };
+
   const fetchDashboardData = async () => {
     try {
-      const [patientsRes, appointmentsRes] = await Promise.all([
-        axios.get(`${API}/patients`),
-        axios.get(`${API}/appointments`),
+      const [statsRes, appointmentsRes] = await Promise.all([
+        axios.get(`${API}/dashboard/stats`),
+        axios.get(`${API}/appointments`, { params: { limit: 5 } }),
       ]);
 
-      const today = new Date().toISOString().split('T')[0];
-      const todayAppts = appointmentsRes.data.filter(
-        (appt) => appt.appointment_date === today && appt.status === 'scheduled'
-      );
-
       setStats({
-        totalPatients: patientsRes.data.length,
-        totalAppointments: appointmentsRes.data.length,
-        todayAppointments: todayAppts.length,
+        totalPatients: statsRes.data.total_patients,
+        totalAppointments: statsRes.data.total_appointments,
+        todayAppointments: statsRes.data.today_appointments,
       });
 
-      setRecentAppointments(appointmentsRes.data.slice(0, 5));
+      setRecentAppointments(appointmentsRes.data);
     } catch (error) {
       console.error('Failed to fetch dashboard data:', error);
     } finally {
@@ -8,13 +8,19 @@ import { Label } from '@/components/ui/label';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
 import { toast } from 'sonner';
+import { applyChange } from '@/hooks/use-change-feed';
+import { appendPage, nextCursor } from '@/lib/pagination';
 import { Plus, Edit, Trash2, Search } from 'lucide-react';
 
+// Only what the list renders, so medical history isn't sent for every row
+const LIST_FIELDS = 'first_name,last_name,email,phone,date_of_birth,gender';
+
 const Patients = () => {
   const [patients, setPatients] = useState([]);
-  const [filteredPatients, setFilteredPatients] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [loading, setLoading] = useState(true);
+  const [cursor, setCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [dialogOpen, setDialogOpen] = useState(false);
   const [editingPatient, setEditingPatient] = useState(null);
   const [formData, setFormData] = useState({
@@ -29,24 +35,18 @@ const Patients = () => {
   });
 
   useEffect(() => {
-    fetchPatients();
-  }, []);
-
-  useEffect(() => {
-    const filtered = patients.filter(
-      (patient) =>
-        patient.first_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        patient.last_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        patient.email.toLowerCase().includes(searchTerm.toLowerCase())
-    );
-    setFilteredPatients(filtered);
-  }, [searchTerm, patients]);
+    const timer = setTimeout(() => fetchPatients(), 250);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
 
   const fetchPatients = async () => {
     try {
-      const response = await axios.get(`${API}/patients`);
+      const params = { fields: LIST_FIELDS };
+      const response = searchTerm.trim()
+        ? await axios.get(`${API}/patients/search`, { params: { ...params, q: searchTerm } })
+        : await axios.get(`${API}/patients`, { params });
       setPatients(response.data);
-      setFilteredPatients(response.data);
+      setCursor(nextCursor(response));
     } catch (error) {
       toast.error('Failed to fetch patients');
     } finally {
@@ -54,17 +54,36 @@ const Patients = () => {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/patients`, { params: { fields: LIST_FIELDS, cursor } });
+      setPatients((items) => appendPage(items, response.data));
+      setCursor(nextCursor(response));
+    } catch (error) {
+      toast.error('Failed to fetch patients');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
       if (editingPatient) {
-        await axios.put(`${API}/patients/${editingPatient.id}`, formData);
+        // If-Match rejects the save if someone else changed the record meanwhile
+        const response = await axios.put(`${API}/patients/${editingPatient.id}`, formData, {
+          headers: { 'If-Match': `"${editingPatient.version}"` },
+        });
+        setPatients((items) => applyChange(items, { operation: 'updated', document: response.data }));
         toast.success('Patient updated successfully');
       } else {
-        await axios.post(`${API}/patients`, formData);
+        // Applied locally: the list is oldest first, so a refetch of the
+        // first page would not include the new patient
+        const response = await axios.post(`${API}/patients`, formData);
+        setPatients((items) => applyChange(items, { operation: 'created', document: response.data }));
         toast.success('Patient created successfully');
       }
-      fetchPatients();
       setDialogOpen(false);
       resetForm();
     } catch (error) {
@@ -76,14 +95,22 @@ const Patients = () => {
     if (!window.confirm('Are you sure you want to delete this patient?')) return;
     try {
       await axios.delete(`${API}/patients/${id}`);
+      setPatients((items) => applyChange(items, { operation: 'deleted', document_id: id }));
       toast.success('Patient deleted successfully');
-      fetchPatients();
     } catch (error) {
       toast.error('Failed to delete patient');
     }
   };
 
-  const handleEdit = (patient) => {
+  const handleEdit = async (listed) => {
+    // The list only carries LIST_FIELDS; edit the full, current record
+    let patient;
+    try {
+      patient = (await axios.get(`${API}/patients/${listed.id}`)).data;
+    } catch (error) {
+      toast.error('Failed to load patient');
+      return;
+    }
     setEditingPatient(patient);
     setFormData({
       first_name: patient.first_name,
@@ -273,11 +300,11 @@ const Patients = () => {
             </div>
           </CardHeader>
           <CardContent>
-            {filteredPatients.length === 0 ? (
+            {patients.length === 0 ? (
               <p className="text-gray-500 text-center py-8">No patients found</p>
             ) : (
               <div className="space-y-4">
-                {filteredPatients.map((patient) => (
+                {patients.map((patient) => (
                   <div
                     key={patient.id}
                     className="flex items-center justify-between p-4 bg-white rounded-lg border border-gray-100 hover:border-blue-200 transition-colors"
@@ -314,6 +341,18 @@ const Patients = () => {
                     </div>
                   </div>
                 ))}
+                {cursor && (
+                  <div className="flex justify-center">
+                    <Button
+                      variant="outline"
+                      onClick={loadMore}
+                      disabled={loadingMore}
+                      data-testid="load-more-patients"
+                    >
+                      {loadingMore ? 'Loading...' : 'Load more'}
+                    </Button>
+                  </div>
+                )}
               </div>
             )}
           </CardContent>
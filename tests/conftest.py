@@ -0,0 +1,141 @@
+"""Shared fixtures: the backend app on in-memory Mongo and the stub LLM.
+
+The app is started once per session (its password pool cannot be restarted)
+and every collection is emptied before each test, keeping the indexes.
+"""
+
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import mongomock.collection
+import mongomock_motor
+import motor.motor_asyncio
+import pytest
+from fastapi.testclient import TestClient
+from pymongo import ReturnDocument
+
+ROOT_DIR = Path(__file__).parent.parent
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "smartclinic_test")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("JWT_EXPIRATION_HOURS", "1")
+os.environ["LLM_PROVIDER"] = "stub"
+os.environ["CHANGE_FEED_SOURCE"] = "local"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ORPHAN_SWEEP_INTERVAL_SECONDS"] = "0"
+os.environ["CHAT_HISTORY_FLUSH_SECONDS"] = "3600"
+os.environ["ADMIN_EMAILS"] = "admin@smartclinic.com"
+
+
+def _find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                         return_document=ReturnDocument.BEFORE, **kwargs):
+    # mongomock re-applies `filter` to find the updated document, so with
+    # ReturnDocument.AFTER an update that changes a filtered field (every
+    # versioned write bumps `version`) returns None. Locate it by _id instead.
+    if return_document != ReturnDocument.AFTER:
+        return _original_find_one_and_update(self, filter, update, projection, sort, upsert, return_document, **kwargs)
+    before = _original_find_one_and_update(
+        self, filter, update, {"_id": 1}, sort, upsert, ReturnDocument.BEFORE, **kwargs
+    )
+    if before is None:
+        return self.find_one(filter, projection) if upsert else None
+    return self.find_one({"_id": before["_id"]}, projection)
+
+
+_original_find_one_and_update = mongomock.collection.Collection.find_one_and_update
+mongomock.collection.Collection.find_one_and_update = _find_one_and_update
+motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def api():
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def clean_db(api):
+    async def empty_collections():
+        for name in await server.db.list_collection_names():
+            await server.db[name].delete_many({})
+    api.portal.call(empty_collections)
+    server.clear_user_cache()
+    server.chat_history_writer.pending.clear()
+
+
+def call(api, function, *args):
+    """Run a server coroutine function on the app's event loop."""
+    return api.portal.call(function, *args)
+
+
+def register(api, role="doctor"):
+    response = api.post("/api/auth/register", json={
+        # Admins must be on ADMIN_EMAILS; users are emptied before each test
+        "email": "admin@smartclinic.com" if role == "admin" else f"{role}_{uuid.uuid4().hex[:12]}@smartclinic.com",
+        "password": "TestPass123!",
+        "full_name": f"Test {role.title()}",
+        "role": role,
+    })
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def headers(api):
+    return register(api)
+
+
+@pytest.fixture
+def admin_headers(api):
+    return register(api, role="admin")
+
+
+def add_patient(api, headers, **overrides):
+    response = api.post("/api/patients", headers=headers, json={
+        "first_name": "Jane",
+        "last_name": "Patel",
+        "email": f"patient_{uuid.uuid4().hex[:12]}@example.com",
+        "phone": "+1-555-0100",
+        "date_of_birth": "1985-06-15",
+        "gender": "female",
+        "address": "1 Test Way",
+        "medical_history": "None",
+        **overrides,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def patient(api, headers):
+    return add_patient(api, headers)
+
+
+def book(api, headers, patient, **overrides):
+    return api.post("/api/appointments", headers=headers, json={
+        "patient_id": patient["id"],
+        "patient_name": f"{patient['first_name']} {patient['last_name']}",
+        "doctor_name": "Dr. Chen",
+        "appointment_date": "2030-01-07",
+        "appointment_time": "10:00",
+        "reason": "Checkup",
+        **overrides,
+    })
+
+
+def wait_for_job(api, headers, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = api.get(f"/api/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish")
@@ -0,0 +1,21 @@
+from tests.conftest import register
+
+
+def register_admin(api, email):
+    return api.post("/api/auth/register", json={
+        "email": email, "password": "TestPass123!", "full_name": "Self Promoted", "role": "admin",
+    })
+
+
+def test_admin_role_cannot_be_self_registered(api):
+    response = register_admin(api, "mallory@smartclinic.com")
+    assert response.status_code == 403
+
+    headers = register(api)
+    assert api.put("/api/debug/profiling", headers=headers, json={"sample_rate": 1}).status_code == 403
+
+
+def test_allowlisted_address_registers_as_admin(api):
+    response = register_admin(api, "Admin@SmartClinic.com")
+    assert response.status_code == 200
+    assert response.json()["user"]["role"] == "admin"
@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+
+import server
+from tests.conftest import add_patient
+
+ROW = {
+    "first_name": "Ana",
+    "last_name": "Lima",
+    "email": "ana@example.com",
+    "phone": "+1-555-0110",
+    "date_of_birth": "1990-02-01",
+    "gender": "female",
+    "address": "2 Test Way",
+    "medical_history": "Asthma, mild",
+}
+
+
+def ndjson(*records):
+    return "\n".join(record if isinstance(record, str) else json.dumps(record) for record in records) + "\n"
+
+
+def test_ndjson_import_inserts_valid_rows_and_reports_the_rest(api, headers, monkeypatch):
+    monkeypatch.setattr(server, "BULK_IMPORT_BATCH_SIZE", 2)
+    body = ndjson(
+        ROW,
+        {**ROW, "first_name": "Bo"},
+        "{not json",
+        "",
+        {**ROW, "first_name": "Cy"},
+        {key: value for key, value in ROW.items() if key != "email"},
+        [1, 2],
+    )
+
+    response = api.post("/api/patients/bulk", headers={**headers, "Content-Type": "application/x-ndjson"}, content=body)
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["failed"], result["errors_truncated"]) == (3, 3, False)
+    assert [error["row"] for error in result["errors"]] == [3, 5, 6]
+    assert "email" in result["errors"][1]["error"]
+
+    names = sorted(p["first_name"] for p in api.get("/api/patients", headers=headers).json())
+    assert names == ["Ana", "Bo", "Cy"]
+    assert api.get("/api/dashboard/stats", headers=headers).json()["total_patients"] == 3
+    # Imported rows are searchable like created ones
+    assert [p["first_name"] for p in api.get("/api/patients/search", headers=headers, params={"q": "Cy Lima"}).json()][0] == "Cy"
+
+
+def test_csv_import_handles_quoted_fields(api, headers):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(ROW))
+    writer.writeheader()
+    writer.writerow({**ROW, "medical_history": "Line one\nLine \"two\""})
+    writer.writerow({**ROW, "email": "not-an-email"})
+
+    response = api.post("/api/patients/bulk", headers={**headers, "Content-Type": "text/csv"},
+                        content=buffer.getvalue().encode())
+
+    result = response.json()
+    assert (result["inserted"], result["failed"]) == (1, 1)
+    assert result["errors"][0]["row"] == 2
+    [patient] = api.get("/api/patients", headers=headers).json()
+    assert patient["medical_history"] == "Line one\nLine \"two\""
+
+
+def test_import_errors_are_capped(api, headers, monkeypatch):
+    monkeypatch.setattr(server, "BULK_IMPORT_MAX_ERRORS", 2)
+
+    result = api.post("/api/patients/bulk", headers=headers, content=ndjson(*["{"] * 5)).json()
+
+    assert (result["failed"], len(result["errors"]), result["errors_truncated"]) == (5, 2, True)
+
+
+def test_export_streams_every_patient(api, headers):
+    first, second = [
+        # As stored, which may round timestamps
+        api.get(f"/api/patients/{patient['id']}", headers=headers).json()
+        for patient in (add_patient(api, headers, first_name="Ana", medical_history="Notes, with a comma"),
+                        add_patient(api, headers, first_name="Bo"))
+    ]
+
+    response = api.get("/api/patients/export", headers=headers)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert exported == [first, second]
+
+    response = api.get("/api/patients/export", headers=headers, params={"format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows] == [first["id"], second["id"]]
+    assert rows[0]["medical_history"] == "Notes, with a comma"
+    assert rows[0]["created_at"] == first["created_at"]
+
+    assert api.get("/api/patients/export", headers=headers, params={"format": "xml"}).status_code == 422
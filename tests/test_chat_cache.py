@@ -0,0 +1,26 @@
+import pytest
+
+import server
+from tests.conftest import call
+
+
+@pytest.fixture(autouse=True)
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(server, "CHAT_CACHE_ENABLED", True)
+
+
+def test_exact_repeats_are_shared_but_near_matches_stay_per_user(api):
+    question = "What is the recommended daily dose of vitamin D for adults over fifty years old?"
+    call(api, server.store_cached_response, "user-a", question, "Reply for A")
+
+    assert call(api, server.lookup_cached_response, "user-b", question.lower()) == "Reply for A"
+    assert call(api, server.lookup_cached_response, "user-a", question + " Today?") == "Reply for A"
+    assert call(api, server.lookup_cached_response, "user-b", question + " Today?") is None
+
+
+def test_word_order_and_negation_change_the_question(api):
+    call(api, server.store_cached_response, "user-a", "Can I take aspirin with ibuprofen?", "Reply")
+
+    assert call(api, server.lookup_cached_response, "user-a", "Please, can I take aspirin with ibuprofen") == "Reply"
+    assert call(api, server.lookup_cached_response, "user-a", "Can I take ibuprofen with aspirin?") is None
+    assert call(api, server.lookup_cached_response, "user-a", "Can I not take aspirin with ibuprofen?") is None
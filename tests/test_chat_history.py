@@ -0,0 +1,69 @@
+import asyncio
+
+import server
+from tests.conftest import call
+
+
+def test_turns_are_visible_before_and_after_the_batched_write(api, headers):
+    first = api.post("/api/chat/message", headers=headers, json={"message": "What is a normal heart rate?"})
+    session_id = first.json()["session_id"]
+    api.post("/api/chat/message", headers=headers, json={"message": "And during exercise?", "session_id": session_id})
+
+    # Still queued: nothing written yet, but history already includes both turns
+    assert call(api, server.db.chat_history.count_documents, {}) == 0
+    history = api.get(f"/api/chat/history/{session_id}", headers=headers).json()
+    assert [turn["message"] for turn in history] == ["What is a normal heart rate?", "And during exercise?"]
+
+    call(api, server.chat_history_writer.flush)
+
+    assert server.chat_history_writer.pending == []
+    assert call(api, server.db.chat_history.count_documents, {"session_id": session_id}) == 2
+    history = api.get(f"/api/chat/history/{session_id}", headers=headers).json()
+    assert [turn["message"] for turn in history] == ["What is a normal heart rate?", "And during exercise?"]
+
+
+def test_rewriting_an_already_written_batch_is_harmless(api, headers):
+    api.post("/api/chat/message", headers=headers, json={"message": "What is a fever?"})
+    batch = list(server.chat_history_writer.pending)
+
+    assert call(api, server.chat_history_writer.write_batch, batch)
+    # A retry after a partial failure re-sends turns that were already stored
+    assert call(api, server.chat_history_writer.write_batch, batch)
+    assert call(api, server.db.chat_history.count_documents, {}) == 1
+
+
+def test_a_long_question_is_cut_in_the_session_summary(api, headers):
+    first = api.post("/api/chat/message", headers=headers, json={"message": "Why does my knee ache? " * 400})
+    call(api, server.chat_history_writer.flush)
+
+    session = call(api, server.db.chat_sessions.find_one, {"session_id": first.json()["session_id"]})
+    question = session["lines"][-1].split("\n")[0]
+    assert len(question) <= len("User: ") + server.CHAT_SUMMARY_EXCERPT_CHARS + len("...")
+    assert server.estimate_tokens("\n".join(session["lines"])) <= server.CHAT_CONTEXT_TOKEN_BUDGET
+
+
+def test_stopping_mid_batch_applies_each_summary_once(api, monkeypatch):
+    summarized = []
+
+    async def scenario():
+        writer = server.ChatHistoryWriter(10, 3600, 100)
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_summary(session_id, user_id, turns):
+            summarized.append([turn["id"] for turn in turns])
+            started.set()
+            await release.wait()
+        monkeypatch.setattr(server, "update_session_summary", slow_summary)
+
+        writer.start()
+        writer.add(server.ChatHistory(session_id="s", user_id="u", message="Hi", response="Hello").model_dump())
+        writer.wakeup.set()
+        await started.wait()
+        stopping = asyncio.create_task(writer.stop())
+        await asyncio.sleep(0)
+        release.set()
+        await stopping
+        return writer.pending
+
+    assert call(api, scenario) == []
+    assert len(summarized) == 1
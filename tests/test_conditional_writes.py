@@ -0,0 +1,64 @@
+from tests.conftest import book
+
+
+def test_stale_if_match_is_rejected_with_412(api, headers, patient):
+    appointment = book(api, headers, patient).json()
+    api.put(f"/api/appointments/{appointment['id']}", headers=headers, json={"reason": "Follow-up"})
+
+    stale = {**headers, "If-Match": '"1"'}
+    assert api.put(f"/api/appointments/{appointment['id']}", headers=stale, json={"reason": "X"}).status_code == 412
+    assert api.put(f"/api/appointments/{appointment['id']}", headers=stale, json={"appointment_time": "15:00"}).status_code == 412
+    assert api.delete(f"/api/appointments/{appointment['id']}", headers=stale).status_code == 412
+
+    # Nothing changed, and the slot is still held
+    stored = api.get(f"/api/appointments/{appointment['id']}", headers=headers).json()
+    assert (stored["reason"], stored["appointment_time"], stored["version"]) == ("Follow-up", "10:00", 2)
+    assert book(api, headers, patient, appointment_time="10:00").status_code == 409
+
+    current = {**headers, "If-Match": '"2"'}
+    assert api.delete(f"/api/appointments/{appointment['id']}", headers=current).status_code == 200
+    assert book(api, headers, patient, appointment_time="10:00").status_code == 200
+
+
+def test_missing_appointment_is_404(api, headers):
+    assert api.get("/api/appointments/missing", headers=headers).status_code == 404
+    assert api.put("/api/appointments/missing", headers=headers, json={"reason": "X"}).status_code == 404
+    assert api.put("/api/appointments/missing", headers=headers, json={"appointment_time": "11:00"}).status_code == 404
+    assert api.delete("/api/appointments/missing", headers=headers).status_code == 404
+
+
+def test_if_match_accepts_the_weak_etag_from_a_read(api, headers, patient):
+    """Deliberate deviation from strong comparison; see parse_if_match."""
+    read = api.get(f"/api/patients/{patient['id']}", headers=headers)
+    assert read.headers["ETag"] == 'W/"1"'
+
+    response = api.put(f"/api/patients/{patient['id']}", headers={**headers, "If-Match": read.headers["ETag"]},
+                       json={"phone": "+1-555-0101"})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == 'W/"2"'
+
+    response = api.put(f"/api/patients/{patient['id']}", headers={**headers, "If-Match": '"2"'},
+                       json={"phone": "+1-555-0102"})
+    assert response.status_code == 200
+
+    stale = {**headers, "If-Match": 'W/"2"'}
+    assert api.put(f"/api/patients/{patient['id']}", headers=stale, json={"phone": "X"}).status_code == 412
+    assert api.put(f"/api/patients/{patient['id']}", headers={**headers, "If-Match": "nope"},
+                   json={"phone": "X"}).status_code == 400
+
+
+def test_create_returns_the_etag_to_use_for_the_next_write(api, headers, patient):
+    created = api.post("/api/patients", headers=headers, json={
+        **{k: patient[k] for k in ("first_name", "last_name", "phone", "date_of_birth", "gender", "address")},
+        "email": "ines.costa@example.com",
+    })
+    assert created.status_code == 200
+    assert created.headers["ETag"] == 'W/"1"'
+
+    booked = book(api, headers, patient)
+    assert booked.headers["ETag"] == 'W/"1"'
+
+    response = api.put(f"/api/appointments/{booked.json()['id']}",
+                       headers={**headers, "If-Match": booked.headers["ETag"]}, json={"reason": "Follow-up"})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == 'W/"2"'
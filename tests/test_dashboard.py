@@ -0,0 +1,28 @@
+import server
+from tests.conftest import book, call
+
+
+def test_stats_follow_bookings_and_deletes(api, headers, patient):
+    today = server.datetime.now(server.timezone.utc).date().isoformat()
+    first = book(api, headers, patient, appointment_date=today).json()
+    book(api, headers, patient, appointment_date="2030-01-07")
+
+    assert api.get("/api/dashboard/stats", headers=headers).json() == {
+        "total_patients": 1, "total_appointments": 2, "today_appointments": 1,
+    }
+
+    api.delete(f"/api/appointments/{first['id']}", headers=headers)
+    assert api.get("/api/dashboard/stats", headers=headers).json()["today_appointments"] == 0
+
+
+def test_appointments_stored_without_a_status_are_migrated_to_scheduled(api, headers, patient):
+    today = server.datetime.now(server.timezone.utc).date().isoformat()
+    appointment = book(api, headers, patient, appointment_date=today).json()
+    call(api, server.db.appointments.update_one, {"id": appointment["id"]}, {"$unset": {"status": ""}})
+
+    call(api, server.migrate_appointment_statuses)
+    stats = call(api, server.rebuild_dashboard_counters)
+
+    assert stats.today_appointments == 1
+    listed = api.get("/api/appointments", headers=headers, params={"status": "scheduled"}).json()
+    assert [a["id"] for a in listed] == [appointment["id"]]
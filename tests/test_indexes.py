@@ -0,0 +1,43 @@
+from pymongo import ASCENDING, IndexModel
+
+import server
+from tests.conftest import call
+
+
+def index_names(api, collection):
+    return set(call(api, collection.index_information))
+
+
+def test_an_index_with_the_same_keys_under_another_name_is_kept(api):
+    patients = server.db.patients
+    call(api, patients.drop_index, "patients_search_grams")
+    call(api, patients.create_index, [("search_grams", ASCENDING)])
+    try:
+        call(api, server.ensure_indexes)
+        names = index_names(api, patients)
+        assert "search_grams_1" in names
+        assert "patients_search_grams" not in names
+    finally:
+        call(api, patients.drop_index, "search_grams_1")
+        call(api, server.ensure_indexes)
+
+
+def test_an_index_with_changed_options_is_rebuilt(api):
+    chat_cache = server.db.chat_cache
+    call(api, chat_cache.drop_index, "chat_cache_ttl")
+    call(api, chat_cache.create_indexes, [IndexModel([("created_at", ASCENDING)], expireAfterSeconds=60, name="chat_cache_ttl")])
+
+    call(api, server.ensure_indexes)
+
+    info = call(api, chat_cache.index_information)
+    assert info["chat_cache_ttl"]["expireAfterSeconds"] == server.CHAT_CACHE_TTL
+
+
+def test_a_ttl_of_zero_seconds_is_not_mistaken_for_no_ttl(api):
+    rate_limits = server.db.rate_limits
+    call(api, rate_limits.drop_index, "rate_limits_ttl")
+    call(api, rate_limits.create_indexes, [IndexModel([("expires_at", ASCENDING)], name="rate_limits_ttl")])
+
+    call(api, server.ensure_indexes)
+
+    assert call(api, rate_limits.index_information)["rate_limits_ttl"]["expireAfterSeconds"] == 0
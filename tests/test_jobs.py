@@ -0,0 +1,39 @@
+import server
+from tests.conftest import book, call, wait_for_job
+
+
+def test_deleting_a_patient_removes_their_appointments_in_the_background(api, headers, patient, monkeypatch):
+    monkeypatch.setattr(server, "JOB_BATCH_SIZE", 2)
+    for day in range(1, 6):
+        assert book(api, headers, patient, appointment_date=f"2030-01-0{day}").status_code == 200
+
+    response = api.delete(f"/api/patients/{patient['id']}", headers=headers)
+    assert response.status_code == 200
+    job = wait_for_job(api, headers, response.json()["job_id"])
+
+    assert job["status"] == "completed"
+    assert job["progress"] == {"total": 5, "removed": 5}
+    assert api.get("/api/appointments", headers=headers).json() == []
+    assert call(api, server.db.archived_appointments.count_documents, {"patient_id": patient["id"]}) == 5
+    assert api.get("/api/dashboard/stats", headers=headers).json()["total_appointments"] == 0
+    # The freed slots can be booked again
+    assert book(api, headers, {**patient, "id": "another"}, appointment_date="2030-01-01").status_code == 200
+
+
+def test_orphan_sweep_removes_orphans_and_repairs_names(api, headers, admin_headers, patient):
+    stale = book(api, headers, patient, patient_name="Old Name").json()
+    orphan = book(api, headers, patient, appointment_time="11:00").json()
+    call(api, server.db.appointments.update_one, {"id": orphan["id"]}, {"$set": {"patient_id": "deleted"}})
+
+    assert api.post("/api/jobs/orphan-sweep", headers=headers).status_code == 403
+    response = api.post("/api/jobs/orphan-sweep", headers=admin_headers)
+    job = wait_for_job(api, headers, response.json()["id"])
+
+    assert job["status"] == "completed"
+    assert job["progress"] == {"scanned": 2, "orphans_removed": 1, "names_repaired": 1, "intervals_dropped": 0}
+    appointments = api.get("/api/appointments", headers=headers).json()
+    assert [(a["id"], a["patient_name"], a["version"]) for a in appointments] == [(stale["id"], "Jane Patel", 2)]
+
+
+def test_unknown_job_is_404(api, headers):
+    assert api.get("/api/jobs/missing", headers=headers).status_code == 404
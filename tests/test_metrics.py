@@ -0,0 +1,20 @@
+import server
+
+
+def test_metrics_are_off_unless_a_token_is_configured(api, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "")
+
+    assert api.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 404
+
+
+def test_metrics_require_the_configured_token(api, headers, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-secret")
+
+    assert api.get("/metrics").status_code == 401
+    assert api.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    # A user's access token is not a metrics token
+    assert api.get("/metrics", headers=headers).status_code == 401
+
+    response = api.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert "http_requests_total" in response.text
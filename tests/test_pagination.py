@@ -0,0 +1,66 @@
+from tests.conftest import add_patient, book
+
+
+def fetch_all(api, headers, url, **params):
+    pages, cursor = [], None
+    while True:
+        response = api.get(url, headers=headers, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        pages.append([item["id"] for item in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+def test_cursor_pages_cover_every_patient_once_in_order(api, headers):
+    created = [add_patient(api, headers, first_name=f"P{i}")["id"] for i in range(7)]
+
+    pages = fetch_all(api, headers, "/api/patients", limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [item for page in pages for item in page] == created
+
+
+def test_last_full_page_has_no_cursor(api, headers):
+    for i in range(3):
+        add_patient(api, headers, first_name=f"P{i}")
+
+    response = api.get("/api/patients", headers=headers, params={"limit": 3})
+    assert len(response.json()) == 3
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_invalid_cursor_and_limit_are_rejected(api, headers):
+    assert api.get("/api/patients", headers=headers, params={"cursor": "not-a-cursor"}).status_code == 400
+    assert api.get("/api/patients", headers=headers, params={"limit": 0}).status_code == 422
+    assert api.get("/api/patients", headers=headers, params={"limit": 1001}).status_code == 422
+
+
+def test_patients_are_filtered_by_name_prefix(api, headers):
+    add_patient(api, headers, first_name="Johanna", last_name="Smith")
+    add_patient(api, headers, first_name="Mark", last_name="Johnson")
+    add_patient(api, headers, first_name="Ann", last_name="Lee")
+
+    response = api.get("/api/patients", headers=headers, params={"name": "JOH"})
+    assert sorted(p["first_name"] for p in response.json()) == ["Johanna", "Mark"]
+    # A prefix, not a substring, and regex characters are literal
+    assert api.get("/api/patients", headers=headers, params={"name": "ohn"}).json() == []
+    assert api.get("/api/patients", headers=headers, params={"name": ".*"}).json() == []
+
+
+def test_appointments_are_filtered_and_paged(api, headers, patient):
+    for day in range(1, 6):
+        book(api, headers, patient, appointment_date=f"2030-01-0{day}")
+    book(api, headers, patient, appointment_date="2030-01-02", doctor_name="Dr. Okafor")
+    cancelled = book(api, headers, patient, appointment_date="2030-01-03", appointment_time="12:00").json()
+    api.put(f"/api/appointments/{cancelled['id']}", headers=headers, json={"status": "cancelled"})
+
+    pages = fetch_all(api, headers, "/api/appointments", limit=2, doctor_name="Dr. Chen",
+                      date_from="2030-01-02", date_to="2030-01-04", status="scheduled")
+    appointments = [
+        api.get(f"/api/appointments/{item}", headers=headers).json() for page in pages for item in page
+    ]
+
+    assert [len(page) for page in pages] == [2, 1]
+    assert [a["appointment_date"] for a in appointments] == ["2030-01-02", "2030-01-03", "2030-01-04"]
+    assert api.get("/api/appointments", headers=headers, params={"patient_id": "other"}).json() == []
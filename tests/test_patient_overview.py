@@ -0,0 +1,29 @@
+import server
+from tests.conftest import book, call
+
+
+def test_overview_limits_and_orders_appointments_around_now(api, headers, patient):
+    for date in ("2030-03-01", "2030-01-07", "2030-02-01", "2020-01-01", "2021-06-01", "2020-06-01"):
+        assert book(api, headers, patient, appointment_date=date).status_code == 200
+    undated = book(api, headers, patient, appointment_date="2031-01-01").json()
+    call(api, server.db.appointments.update_one, {"id": undated["id"]}, {"$unset": {"starts_at": ""}})
+
+    response = api.get(f"/api/patients/{patient['id']}/overview", headers=headers,
+                       params={"upcoming_limit": 2, "past_limit": 2})
+    assert response.status_code == 200
+    overview = response.json()
+
+    assert overview["patient"]["id"] == patient["id"]
+    assert [a["appointment_date"] for a in overview["upcoming_appointments"]] == ["2030-01-07", "2030-02-01"]
+    assert [a["appointment_date"] for a in overview["past_appointments"]] == ["2021-06-01", "2020-06-01"]
+    # The appointment without a start time is in neither list, so in neither count
+    assert overview["appointment_counts"] == {"total": 7, "upcoming": 3, "past": 3, "by_status": {"scheduled": 7}}
+
+
+def test_overview_of_a_patient_without_appointments(api, headers, patient):
+    overview = api.get(f"/api/patients/{patient['id']}/overview", headers=headers).json()
+
+    assert overview["patient"]["first_name"] == patient["first_name"]
+    assert overview["upcoming_appointments"] == overview["past_appointments"] == []
+    assert overview["appointment_counts"] == {"total": 0, "upcoming": 0, "past": 0, "by_status": {}}
+    assert api.get("/api/patients/missing/overview", headers=headers).status_code == 404
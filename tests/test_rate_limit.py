@@ -0,0 +1,75 @@
+import pytest
+
+import server
+from tests.conftest import register
+
+
+def test_bucket_allows_capacity_then_waits_for_refill():
+    capacity, rate = 3, 1.0
+    bucket = None
+    for _ in range(capacity):
+        tokens, wait = server.refill_bucket(bucket, 100.0, capacity, rate)
+        assert wait == 0
+        bucket = {"tokens": tokens, "updated": 100.0}
+
+    tokens, wait = server.refill_bucket(bucket, 100.0, capacity, rate)
+    assert wait == pytest.approx(1.0)
+
+    # Half a second later half a token has refilled
+    tokens, wait = server.refill_bucket(bucket, 100.5, capacity, rate)
+    assert wait == pytest.approx(0.5)
+
+    tokens, wait = server.refill_bucket(bucket, 101.0, capacity, rate)
+    assert wait == 0
+
+
+@pytest.fixture
+def rate_limited(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(server, "RATE_LIMIT_RULES", {"auth": {"default": (2, 2 / 60)}})
+    monkeypatch.setattr(server, "rate_limit_store", server.MemoryRateLimitStore())
+
+
+def test_login_is_limited_per_client_and_email(api, rate_limited):
+    def login(email):
+        return api.post("/api/auth/login", json={"email": email, "password": "wrong"})
+
+    assert [login("a@smartclinic.com").status_code for _ in range(3)] == [401, 401, 429]
+    limited = login("a@smartclinic.com")
+    assert int(limited.headers["Retry-After"]) >= 1
+
+    # Another account behind the same address has its own bucket
+    assert login("b@smartclinic.com").status_code == 401
+
+
+def test_registration_is_limited_per_client_across_emails(api, monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(server, "RATE_LIMIT_RULES", {
+        "auth": {"default": (2, 2 / 60)},
+        "auth_ip": {"default": (5, 5 / 60)},
+    })
+    monkeypatch.setattr(server, "rate_limit_store", server.MemoryRateLimitStore())
+
+    def register_as(index):
+        return api.post("/api/auth/register", json={
+            "email": f"user{index}@smartclinic.com",
+            "password": "TestPass123!",
+            "full_name": "Test User",
+            "role": "doctor",
+        })
+
+    assert [register_as(i).status_code for i in range(7)] == [200] * 5 + [429] * 2
+
+
+def test_chat_is_limited_per_user(api, monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(server, "RATE_LIMIT_RULES", {"chat": {"default": (1, 1 / 60)}})
+    monkeypatch.setattr(server, "rate_limit_store", server.MemoryRateLimitStore())
+    first, second = register(api), register(api)
+
+    def chat(headers):
+        return api.post("/api/chat/message", headers=headers, json={"message": "How much water should I drink?"})
+
+    assert chat(first).status_code == 200
+    assert chat(first).status_code == 429
+    assert chat(second).status_code == 200
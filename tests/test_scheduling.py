@@ -0,0 +1,168 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import server
+from tests.conftest import book, call, wait_for_job
+
+
+def schedule_intervals(api, doctor_name="Dr. Chen", date="2030-01-07"):
+    schedule = call(api, server.db.doctor_schedules.find_one, {"_id": server.schedule_id(doctor_name, date)})
+    return [(server.format_minutes(i["start"]), i["appointment_id"]) for i in (schedule or {}).get("intervals", [])]
+
+
+def test_overlapping_booking_is_rejected(api, headers, patient):
+    assert book(api, headers, patient, appointment_time="10:00").status_code == 200
+
+    response = book(api, headers, patient, appointment_time="10:15")
+    assert response.status_code == 409
+    assert "already booked" in response.json()["detail"]
+
+    # Back-to-back and other doctors' bookings don't overlap
+    assert book(api, headers, patient, appointment_time="10:30").status_code == 200
+    assert book(api, headers, patient, appointment_time="10:00", doctor_name="Dr. Okafor").status_code == 200
+
+
+def test_concurrent_bookings_of_one_slot_admit_exactly_one(api, headers, patient):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(lambda _: book(api, headers, patient).status_code, range(8)))
+
+    assert sorted(statuses) == [200] + [409] * 7
+    assert len(schedule_intervals(api)) == 1
+
+
+def test_concurrent_reservations_never_overlap(api):
+    async def reserve_all():
+        appointments = [
+            {"id": f"a{i}", "doctor_name": "Dr. Chen", "appointment_date": "2030-01-07",
+             "appointment_time": "10:00", "duration_minutes": 30}
+            for i in range(5)
+        ]
+        return await asyncio.gather(*(server.reserve_interval(a) for a in appointments), return_exceptions=True)
+
+    results = call(api, reserve_all)
+    assert sum(result is None for result in results) == 1
+    assert all(isinstance(result, server.HTTPException) and result.status_code == 409
+               for result in results if result is not None)
+
+
+def test_moving_an_appointment_frees_its_old_slot(api, headers, patient):
+    appointment = book(api, headers, patient, appointment_time="10:00").json()
+
+    response = api.put(f"/api/appointments/{appointment['id']}", headers=headers, json={"appointment_time": "11:00"})
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+
+    assert book(api, headers, patient, appointment_time="10:00").status_code == 200
+    assert book(api, headers, patient, appointment_time="11:00").status_code == 409
+
+
+def test_moving_to_another_day_releases_the_first_day(api, headers, patient):
+    appointment = book(api, headers, patient).json()
+
+    response = api.put(f"/api/appointments/{appointment['id']}", headers=headers, json={"appointment_date": "2030-01-08"})
+    assert response.status_code == 200
+
+    assert schedule_intervals(api, date="2030-01-07") == []
+    assert schedule_intervals(api, date="2030-01-08") == [("10:00", appointment["id"])]
+
+
+def test_rejected_move_keeps_the_original_slot(api, headers, patient):
+    appointment = book(api, headers, patient, appointment_time="10:00").json()
+    book(api, headers, patient, appointment_time="11:00")
+
+    response = api.put(f"/api/appointments/{appointment['id']}", headers=headers, json={"appointment_time": "11:00"})
+    assert response.status_code == 409
+
+    stored = api.get(f"/api/appointments/{appointment['id']}", headers=headers).json()
+    assert stored["appointment_time"] == "10:00"
+    assert stored["version"] == 1
+    assert book(api, headers, patient, appointment_time="10:00").status_code == 409
+
+
+def test_cancelling_frees_the_slot(api, headers, patient):
+    appointment = book(api, headers, patient).json()
+
+    response = api.put(f"/api/appointments/{appointment['id']}", headers=headers, json={"status": "cancelled"})
+    assert response.status_code == 200
+
+    assert book(api, headers, patient).status_code == 200
+
+
+def test_lost_update_leaves_the_winning_slot_booked(api, headers, patient, monkeypatch):
+    """A moves to 11:00 and wins; B, which read the old version, tried 12:00."""
+    appointment = book(api, headers, patient, appointment_time="10:00").json()
+    apply_schedule_change = server.apply_schedule_change
+
+    async def concurrent_move_first(before, after):
+        monkeypatch.setattr(server, "apply_schedule_change", apply_schedule_change)
+        moved = {**before, "appointment_time": "11:00"}
+        await server.reserve_interval(moved)
+        await server.db.appointments.update_one(
+            {"id": before["id"]},
+            {"$set": {"appointment_time": "11:00", **server.appointment_bounds(moved)}, "$inc": {"version": 1}}
+        )
+        await apply_schedule_change(before, after)
+
+    monkeypatch.setattr(server, "apply_schedule_change", concurrent_move_first)
+    response = api.put(
+        f"/api/appointments/{appointment['id']}",
+        headers={**headers, "If-Match": '"1"'},
+        json={"appointment_time": "12:00"},
+    )
+
+    assert response.status_code == 412
+    assert schedule_intervals(api) == [("11:00", appointment["id"])]
+    assert book(api, headers, patient, appointment_time="11:00").status_code == 409
+    assert book(api, headers, patient, appointment_time="12:00").status_code == 200
+
+
+def test_orphan_sweep_drops_phantom_intervals(api, headers, admin_headers, patient, monkeypatch):
+    kept = book(api, headers, patient, appointment_time="09:00").json()
+    moved = book(api, headers, patient, appointment_time="10:00").json()
+    # A booking that died before saving, and a move whose save never landed
+    call(api, server.reserve_interval, {**moved, "id": "crashed", "appointment_time": "12:00"})
+    call(api, server.reserve_interval, {**moved, "appointment_time": "14:00"})
+    monkeypatch.setattr(server, "SCHEDULE_INTERVAL_GRACE", 0)
+
+    job = wait_for_job(api, headers, api.post("/api/jobs/orphan-sweep", headers=admin_headers).json()["id"])
+
+    assert job["progress"]["intervals_dropped"] == 2
+    assert schedule_intervals(api) == [("09:00", kept["id"])]
+    assert book(api, headers, patient, appointment_time="12:00").status_code == 200
+
+
+def test_orphan_sweep_keeps_recent_intervals(api, headers, admin_headers, patient):
+    call(api, server.reserve_interval, {
+        "id": "in-flight", "doctor_name": "Dr. Chen", "appointment_date": "2030-01-07", "appointment_time": "10:00"
+    })
+
+    job = wait_for_job(api, headers, api.post("/api/jobs/orphan-sweep", headers=admin_headers).json()["id"])
+
+    assert job["progress"]["intervals_dropped"] == 0
+    assert schedule_intervals(api) == [("10:00", "in-flight")]
+
+
+def test_failed_move_restores_the_stored_slot(api, headers, patient, monkeypatch):
+    appointment = book(api, headers, patient, appointment_time="10:00").json()
+
+    async def failing_update(*args, **kwargs):
+        raise server.PyMongoError("connection reset")
+
+    monkeypatch.setattr(type(server.db.appointments), "find_one_and_update", failing_update)
+    with pytest.raises(server.PyMongoError):
+        api.put(f"/api/appointments/{appointment['id']}", headers=headers, json={"appointment_time": "11:00"})
+    monkeypatch.undo()
+
+    assert schedule_intervals(api) == [("10:00", appointment["id"])]
+
+
+def test_availability_stays_on_the_slot_grid_after_an_off_grid_booking(api, headers, patient):
+    assert book(api, headers, patient, appointment_time="10:15", duration_minutes=20).status_code == 200
+
+    response = api.get("/api/availability", headers=headers,
+                       params={"doctor_name": "Dr. Chen", "date_from": "2030-01-07", "slot_minutes": 30})
+
+    expected = ["09:00", "09:30"] + [f"{hour:02d}:{minute:02d}" for hour in range(11, 17) for minute in (0, 30)]
+    assert response.json() == [{"doctor_name": "Dr. Chen", "date": "2030-01-07", "slots": expected}]
@@ -0,0 +1,58 @@
+from tests.conftest import add_patient
+
+
+def search(api, headers, q, **params):
+    response = api.get("/api/patients/search", headers=headers, params={"q": q, **params})
+    assert response.status_code == 200, response.text
+    return [f"{p['first_name']} {p['last_name']}" for p in response.json()]
+
+
+def test_search_ranks_exact_matches_first_and_tolerates_typos(api, headers):
+    add_patient(api, headers, first_name="John", last_name="Smith")
+    add_patient(api, headers, first_name="Jon", last_name="Smyth")
+    add_patient(api, headers, first_name="Maria", last_name="Garcia")
+
+    assert search(api, headers, "john smith")[0] == "John Smith"
+    assert search(api, headers, "smyth")[0] == "Jon Smyth"
+    # Misspelt, transposed, and typed as a prefix
+    assert "John Smith" in search(api, headers, "jhon")
+    assert search(api, headers, "garica")[0] == "Maria Garcia"
+    assert search(api, headers, "mar")[0] == "Maria Garcia"
+    assert "Maria Garcia" not in search(api, headers, "john smith")
+
+
+def test_single_letters_find_names_starting_with_them(api, headers):
+    add_patient(api, headers, first_name="Jane", last_name="Doe")
+    add_patient(api, headers, first_name="Kofi", last_name="Mensah")
+
+    assert search(api, headers, "J") == ["Jane Doe"]
+    assert search(api, headers, "!!") == []
+
+
+def test_search_covers_email_and_phone(api, headers):
+    add_patient(api, headers, first_name="Ana", last_name="Lima", email="ana.lima@example.com", phone="+1-555-0199")
+    add_patient(api, headers, first_name="Bo", last_name="Berg", phone="+1-555-7788")
+
+    assert search(api, headers, "ana.lima@example.com") == ["Ana Lima"]
+    assert search(api, headers, "0199") == ["Ana Lima"]
+
+
+def test_search_follows_updates_and_deletes(api, headers):
+    patient = add_patient(api, headers, first_name="Omar", last_name="Haddad")
+
+    api.put(f"/api/patients/{patient['id']}", headers=headers, json={"last_name": "Nasser"})
+    assert search(api, headers, "haddad") == []
+    assert search(api, headers, "nasser") == ["Omar Nasser"]
+
+    api.delete(f"/api/patients/{patient['id']}", headers=headers)
+    assert search(api, headers, "nasser") == []
+
+
+def test_search_results_are_limited_and_hide_index_fields(api, headers):
+    for i in range(5):
+        add_patient(api, headers, first_name="Lee", last_name=f"Park{i}")
+
+    response = api.get("/api/patients/search", headers=headers, params={"q": "lee", "limit": 3})
+    assert len(response.json()) == 3
+    assert not {"search_grams", "search_version", "first_name_lower"} & response.json()[0].keys()
+    assert api.get("/api/patients/search", headers=headers, params={"q": ""}).status_code == 422